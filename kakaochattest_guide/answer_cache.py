@@ -0,0 +1,131 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+import db.db
+
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# 비워두면 정규화된 문장이 정확히 같을 때만 hit. 0.95 처럼 주면 코사인 유사도로 비슷한 질문도 hit
+ANSWER_CACHE_SIMILARITY = os.environ.get("ANSWER_CACHE_SIMILARITY", "")
+
+
+def normalize(utterance: str) -> str:
+    text = unicodedata.normalize("NFKC", utterance).lower()
+    return re.sub(r"[\W_]+", " ", text).strip()
+
+
+def _key(utterance: str, context: str) -> tuple:
+    # 대화 기록이 없는 첫 질문끼리는 모든 사용자가 같은 항목을 나눠 쓴다
+    context_key = hashlib.sha256(context.encode("utf-8")).hexdigest() if context else ""
+    return context_key, normalize(utterance)
+
+
+class AnswerCache:
+    """자주 묻는 질문의 답변을 LLM 호출 없이 돌려주기 위한 LRU + TTL 캐시.
+
+    답변은 이전 대화(context)에 따라 달라지므로 context 가 같은 항목끼리만 재사용한다.
+    """
+
+    def __init__(
+        self,
+        max_size: int = ANSWER_CACHE_SIZE,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold: Optional[float] = None,
+        embed: Callable[[list[str]], list] = db.db.embed,
+        version: Callable[[], str] = db.db.corpus_version,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._embed = embed
+        self._version = version
+        self._current_version = None
+        self._entries = OrderedDict()  # (context 해시, 정규화된 질문) -> (answer, embedding, expires_at)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def get(self, utterance: str, context: str = "") -> Optional[str]:
+        key = _key(utterance, context)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            # 의미 매칭을 끈 경우 (기본값) 에는 miss 마다 전체 항목을 훑지 않는다
+            candidates = [] if self.similarity_threshold is None else [
+                (k, e) for k, e in self._entries.items() if k[0] == key[0] and e[1] is not None and e[2] > now
+            ]
+
+        if candidates:
+            query = self._embedding(key[1])
+            matrix = np.stack([e[1] for _, e in candidates])
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                with self._lock:
+                    if candidates[best][0] in self._entries:
+                        self._entries.move_to_end(candidates[best][0])
+                    self.hits += 1
+                    self.semantic_hits += 1
+                return candidates[best][1][0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, utterance: str, answer: str, context: str = ""):
+        key = _key(utterance, context)
+        embedding = self._embedding(key[1]) if self.similarity_threshold is not None else None
+        with self._lock:
+            self._check_version()
+            self._entries[key] = (answer, embedding, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _check_version(self):
+        # data/*.txt 가 바뀌면 이전 답변은 모두 버린다
+        version = self._version()
+        if version != self._current_version:
+            self._entries.clear()
+            self._current_version = version
+
+    def _embedding(self, text: str) -> np.ndarray:
+        vector = np.asarray(self._embed([text])[0], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+
+ANSWER_CACHE = AnswerCache(
+    similarity_threshold=float(ANSWER_CACHE_SIMILARITY) if ANSWER_CACHE_SIMILARITY else None,
+)
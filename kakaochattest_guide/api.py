@@ -1,13 +1,110 @@
 #-*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from fastapi import BackgroundTasks
-from fastapi.responses import HTMLResponse
-from dto import ChatbotRequest
-from samples import simple_text_sample, basic_card_sample, commerce_card_sample
-from callback import callback_handler
-import openai
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from dto import SkillRequest
+from samples import SIMPLE_TEXT_SAMPLE_BYTES, BASIC_CARD_SAMPLE_BYTES, COMMERCE_CARD_SAMPLE_BYTES
+import deadlines
+import http_client
+import job_queue
+import metrics
+import responses
+
+logger = logging.getLogger("API")
+
+# /callback 에서 이 시간 안에 답이 나오면 콜백 없이 바로 응답한다 (카카오 스킬 타임아웃 5초). 0 이면 항상 콜백
+SYNC_ANSWER_SECONDS = float(os.environ.get("SYNC_ANSWER_SECONDS", "3.5"))
+
+# warm-up 이 실패하면 (인덱스 없음, 잘못된 키 등) 이 간격부터 두 배씩 늘려가며 다시 시도한다
+WARM_UP_RETRY_SECONDS = float(os.environ.get("WARM_UP_RETRY_SECONDS", "5"))
+WARM_UP_MAX_RETRY_SECONDS = float(os.environ.get("WARM_UP_MAX_RETRY_SECONDS", "300"))
+
+WARM_UP_SECONDS = metrics.Gauge("app_warm_up_seconds", "Time spent loading the callback pipeline")
+WARM_UP_FAILURES = metrics.Counter("app_warm_up_failures_total", "Failed attempts to load the callback pipeline")
+CALLBACK_ANSWERS = metrics.Counter("callback_answers_total", "/callback answers by delivery path")
+
+# /callback 요청은 디스크 큐에 쌓고 워커들이 꺼내서 처리한다 (재시작해도 유실되지 않음)
+# 핸들러(callback.py) 는 langchain / chroma 를 끌고 오므로 서버가 뜬 뒤 백그라운드에서 불러온다
+workers = job_queue.WorkerPool(job_queue.SQLiteJobQueue(), handler=None)
+# warm-up 이 끝나면 callback 모듈이 들어간다
+pipeline = None
+# 마지막 warm-up 실패 이유. /ready 에서 보여준다
+_warm_up_error = None
+# 마감 시간을 넘겨 콜백으로 넘어간 답변들 -> 작업 id. 작업 자체는 lease 를 잡은 채 큐에 들어 있다
+_late_answers = {}
+
+# /callback 의 즉시 응답도 고정 문구라 미리 직렬화해 둔다
+BUSY_RESPONSE_BYTES = responses.serialize(responses.skill_response([
+    responses.simple_text("지금 질문이 너무 많아 답변이 어려워요😢 잠시 후 다시 물어봐 주세요!")
+]))
+USE_CALLBACK_RESPONSE_BYTES = responses.serialize(responses.use_callback(
+    "생각하고 있는 중이에요😘 \n15초 정도 소요될 거 같아요 기다려 주실래요?!"
+))
+
+
+def _load_pipeline():
+    started = time.perf_counter()
+    import callback
+    callback.warm_up()
+    WARM_UP_SECONDS.set(time.perf_counter() - started)
+    return callback
+
 
-app = FastAPI()
+async def _warm_up():
+    global pipeline, _warm_up_error
+    delay = WARM_UP_RETRY_SECONDS
+    while pipeline is None:
+        try:
+            pipeline = await asyncio.to_thread(_load_pipeline)
+        except Exception as e:
+            # 그동안 /callback 은 큐에 쌓아 두고, 준비되면 워커가 처리한다
+            _warm_up_error = repr(e)
+            WARM_UP_FAILURES.inc()
+            logger.exception(f"callback pipeline warm-up failed, retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARM_UP_MAX_RETRY_SECONDS)
+    _warm_up_error = None
+    workers.handler = pipeline.callback_handler
+    await workers.start()
+
+
+async def _deliver_late(task: asyncio.Future, id: str, req: SkillRequest, deadline: float):
+    # 응답은 이미 useCallback 으로 나갔으므로 만들어지는 대로 callbackUrl 로 보낸다
+    try:
+        payload = await task
+        if payload is not None:
+            await pipeline.post_answer(req, payload, deadline)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # 큐에 lease 를 잡고 넣어 둔 작업이므로 nack 하면 워커가 다시 처리한다
+        logger.exception("late answer failed, retrying through the job queue")
+        await workers.nack(id)
+    else:
+        await workers.ack(id)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 콜백 전송용 HTTP 세션은 프로세스당 하나만 열어 keep-alive 로 재사용
+    await http_client.start()
+    warm_up = asyncio.ensure_future(_warm_up())
+    yield
+    warm_up.cancel()
+    # 아직 끝나지 않은 답변은 lease 를 풀어 두고 재시작한 뒤 워커가 처리한다
+    for task, id in list(_late_answers.items()):
+        task.cancel()
+        await workers.nack(id)
+    await workers.stop()
+    await http_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 async def home():
@@ -20,28 +117,65 @@ async def home():
     """
     return HTMLResponse(content=page, status_code=200)
 
+@app.get("/ready")
+async def ready():
+    # 콜백 파이프라인까지 준비돼야 ready. 그 전에도 /skill/* 과 /callback 접수는 가능하다
+    if workers.handler is None:
+        return JSONResponse(content={"ready": False, "error": _warm_up_error}, status_code=503)
+    return {"ready": True}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+# 고정 응답만 내려주는 스킬은 요청 본문을 읽지도 검사하지도 않는다 (body 파라미터를 선언하지 않음)
 @app.post("/skill/hello")
-def skill(req: ChatbotRequest):
-    return simple_text_sample
+async def skill():
+    return responses.raw(SIMPLE_TEXT_SAMPLE_BYTES)
 
 @app.post("/skill/basic-card")
-async def skill(req: ChatbotRequest):
-    return basic_card_sample
+async def skill():
+    return responses.raw(BASIC_CARD_SAMPLE_BYTES)
 
 @app.post("/skill/commerce-card")
-async def skill(req: ChatbotRequest):
-    return commerce_card_sample
+async def skill():
+    return responses.raw(COMMERCE_CARD_SAMPLE_BYTES)
 
 # callback.py 로 연결
 @app.post("/callback")
-async def skill(req: ChatbotRequest, background_tasks: BackgroundTasks):
-    #핸들러 호출 / background_tasks 변경가능
-    background_tasks.add_task(callback_handler, req)
-    out = {
-        "version" : "2.0",
-        "useCallback" : True,
-        "data": {
-            "text" : "생각하고 있는 중이에요😘 \n15초 정도 소요될 거 같아요 기다려 주실래요?!"
-        }
-    }
-    return out
+async def skill(req: SkillRequest):
+    # callbackUrl 이 유효한 동안만 처리한다. 큐를 거쳐도 이 마감 시각이 같이 넘어간다
+    deadline = deadlines.new_deadline()
+    # 바로 답해 볼 수 있으면 직접 처리 중(lease)으로 큐에 넣는다. 어느 경로든 먼저 디스크 큐에 남긴다
+    inline = pipeline is not None and SYNC_ANSWER_SECONDS > 0
+    id = job_queue.job_id(req)
+    enqueued = await workers.submit(req, deadline, id=id, lease=inline)
+    if enqueued is None:
+        # 큐가 가득 차면 작업을 더 쌓지 않고 바로 답한다
+        return responses.raw(BUSY_RESPONSE_BYTES)
+    if not enqueued or not inline:
+        # 이미 받은 요청이거나 워커가 처리할 작업
+        CALLBACK_ANSWERS.inc(path="queue")
+        return responses.raw(USE_CALLBACK_RESPONSE_BYTES)
+
+    # 캐시 히트 / 짧은 답변처럼 빨리 끝나는 경우는 콜백 왕복 없이 바로 답한다
+    answer = asyncio.ensure_future(pipeline.respond(req, deadline))
+    done, _ = await asyncio.wait({answer}, timeout=SYNC_ANSWER_SECONDS)
+    if answer not in done:
+        CALLBACK_ANSWERS.inc(path="callback")
+        task = asyncio.ensure_future(_deliver_late(answer, id, req, deadline))
+        _late_answers[task] = id
+        task.add_done_callback(lambda task: _late_answers.pop(task, None))
+        return responses.raw(USE_CALLBACK_RESPONSE_BYTES)
+    if answer.exception() is not None:
+        # 실패했으면 lease 를 풀어 워커가 재시도하게 한다
+        logger.error(f"inline answer failed: {answer.exception()!r}")
+        await workers.nack(id)
+        CALLBACK_ANSWERS.inc(path="queue")
+        return responses.raw(USE_CALLBACK_RESPONSE_BYTES)
+    await workers.ack(id)
+    if answer.result() is None:
+        # 마감이 지나 버려진 요청
+        return responses.raw(USE_CALLBACK_RESPONSE_BYTES)
+    CALLBACK_ANSWERS.inc(path="inline")
+    return answer.result()
@@ -0,0 +1,92 @@
+# 두 번 호출하는 파이프라인(intent -> guide) 과 한 번의 structured 호출을 같은 질문들로 비교한다.
+#   python bench/pipeline_ab.py [eval/questions.json] [--repeat 1]
+#
+# 실제 OpenAI API 를 부르므로 .env 의 API_KEY 가 필요하다 (intent_router.py --llm 과 같음).
+# 모드마다 eval 질문을 하나씩 callback._answer 로 답하게 하고, 그동안 늘어난
+# llm_call_seconds / llm_tokens_total 과 질문당 응답 시간을 출력한다.
+# 답변 캐시는 _respond 에서만 쓰므로 여기서는 매번 LLM 을 부른다.
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+# warm_up 이 structured 모드용 LLM 도 만들도록 한다. 모드는 아래에서 callback.PIPELINE_MODE 로 바꾼다
+os.environ["PIPELINE_MODE"] = "structured"
+
+import callback  # noqa: E402
+import metrics  # noqa: E402
+
+MODES = ["two_call", "structured"]
+
+
+def _totals() -> dict:
+    totals = {"llm_calls": 0, "llm_call_seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+    with metrics._lock:
+        for _, total, count in metrics.LLM_CALL_SECONDS._values.values():
+            totals["llm_calls"] += count
+            totals["llm_call_seconds"] += total
+        for labels, value in metrics.LLM_TOKENS._values.items():
+            totals[f"{dict(labels)['kind']}_tokens"] += value
+    return totals
+
+
+async def _run(questions: list[str]) -> tuple[list[float], int]:
+    latencies, errors = [], 0
+    for question in questions:
+        started = time.perf_counter()
+        try:
+            await callback._answer(question, "")
+        except Exception as e:
+            errors += 1
+            print(f"  {question!r}: {e!r}")
+            continue
+        latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("questions", nargs="?", default=os.path.join("eval", "questions.json"))
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.questions, "r") as f:
+        questions = [sample["question"] for sample in json.load(f)] * args.repeat
+
+    callback.warm_up()
+    results = {}
+    for mode in MODES:
+        callback.PIPELINE_MODE = mode
+        before = _totals()
+        latencies, errors = asyncio.run(_run(questions))
+        after = _totals()
+        delta = {name: after[name] - before[name] for name in after}
+        latencies.sort()
+        result = {
+            **delta,
+            "questions": len(questions),
+            "errors": errors,
+            "llm_calls_per_question": delta["llm_calls"] / len(questions),
+            "tokens_per_question": (delta["prompt_tokens"] + delta["completion_tokens"]) / len(questions),
+            "p50_seconds": latencies[len(latencies) // 2] if latencies else None,
+            "mean_seconds": sum(latencies) / len(latencies) if latencies else None,
+        }
+        results[mode] = result
+        print(f"{mode}: {result}")
+
+    diff = {
+        name: results["structured"][name] - results["two_call"][name]
+        for name in results["two_call"]
+        if name not in ("questions", "errors")
+        and results["two_call"][name] is not None and results["structured"][name] is not None
+    }
+    print(f"structured - two_call: {diff}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# 2~5KB 짜리 실제 크기의 카카오 스킬 요청으로 요청 본문 검사 비용을 잰다.
+#   python bench/request_validation.py --sizes 2200 5300 --requests 5000
+#
+# 1. 고정 응답 스킬: 본문을 ChatbotRequest 로 검사하는 라우트 vs api.app (본문을 읽지 않음)
+# 2. /callback 요청 한 건의 파싱 + 검사: ChatbotRequest (전체) vs SkillRequest (쓰는 필드만)
+import argparse
+import asyncio
+import json
+import timeit
+
+from fastapi import FastAPI
+
+from skill_responses import PATHS, rate
+from worker_throughput import BODY
+
+# skill_responses 가 저장소 경로를 sys.path 에 넣어 둔다
+from dto import ChatbotRequest, SkillRequest
+
+
+def payload(size: int) -> bytes:
+    """action params / detailParams 를 채워 size 바이트 정도가 되게 한 스킬 요청."""
+    body = json.loads(json.dumps(BODY))
+    body["userRequest"]["callbackUrl"] = "https://bot-api.kakao.com/callback/123"
+    body["userRequest"]["user"]["properties"]["appUserId"] = "1234567890"
+    action = body["action"]
+    i = 0
+    while len(json.dumps(body, ensure_ascii=False).encode("utf-8")) < size:
+        name = f"param_{i}"
+        action["params"][name] = f"값 {i}"
+        action["detailParams"][name] = {"origin": f"값 {i}", "value": f"값 {i}", "groupName": ""}
+        i += 1
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def validating_app() -> FastAPI:
+    import samples
+    import responses
+
+    app = FastAPI()
+
+    @app.post("/skill/hello")
+    async def hello(req: ChatbotRequest):
+        return responses.raw(samples.SIMPLE_TEXT_SAMPLE_BYTES)
+
+    @app.post("/skill/basic-card")
+    async def basic_card(req: ChatbotRequest):
+        return responses.raw(samples.BASIC_CARD_SAMPLE_BYTES)
+
+    @app.post("/skill/commerce-card")
+    async def commerce_card(req: ChatbotRequest):
+        return responses.raw(samples.COMMERCE_CARD_SAMPLE_BYTES)
+
+    return app
+
+
+def _microseconds(model, body: bytes, number: int) -> float:
+    return timeit.timeit(lambda: model(**json.loads(body)), number=number) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2200, 5300])
+    parser.add_argument("--paths", nargs="+", default=PATHS)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    import api
+
+    before, after = validating_app(), api.app
+    print(f"requests={args.requests}")
+    for size in args.sizes:
+        body = payload(size)
+        for path in args.paths:
+            before_rate = asyncio.run(rate(before, path, body, args.requests))
+            after_rate = asyncio.run(rate(after, path, body, args.requests))
+            print(f"{len(body)} bytes {path}: ChatbotRequest body {before_rate:.0f} req/s -> no body {after_rate:.0f} req/s")
+        full = _microseconds(ChatbotRequest, body, args.requests)
+        minimal = _microseconds(SkillRequest, body, args.requests)
+        print(f"{len(body)} bytes /callback parse + validate: ChatbotRequest {full:.1f} us -> SkillRequest {minimal:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# 고정 응답 스킬(/skill/hello, /skill/basic-card, /skill/commerce-card) 의 처리량을 응답 방식별로 잰다.
+#   python bench/skill_responses.py --requests 5000
+#
+# before: 샘플 dict 를 돌려주고 FastAPI 가 요청마다 jsonable_encoder + JSON 으로 인코딩
+# after : api.app 그대로. samples.py 가 미리 직렬화해 둔 bytes 를 responses.raw() 로 내려보낸다
+# 서버 / 네트워크 없이 ASGI 앱을 같은 프로세스에서 직접 부르므로 앱 안의 비용만 비교된다.
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# api 를 불러오면 작업 큐를 만들므로 저장소의 jobs/ 대신 임시 파일을 쓴다
+os.environ.setdefault("JOB_QUEUE_PATH", os.path.join(tempfile.mkdtemp(), "queue.sqlite3"))
+
+from worker_throughput import BODY  # noqa: E402
+
+PATHS = ["/skill/hello", "/skill/basic-card", "/skill/commerce-card"]
+
+
+def dict_app() -> FastAPI:
+    import samples
+
+    app = FastAPI()
+
+    @app.post("/skill/hello")
+    async def hello():
+        return samples.simple_text_sample
+
+    @app.post("/skill/basic-card")
+    async def basic_card():
+        return samples.basic_card_sample
+
+    @app.post("/skill/commerce-card")
+    async def commerce_card():
+        return samples.commerce_card_sample
+
+    return app
+
+
+async def rate(app, path: str, body: bytes, requests: int) -> float:
+    """path 에 body 를 requests 번 순서대로 POST 하고 초당 요청 수를 돌려준다."""
+    headers = {"content-type": "application/json"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        # 첫 요청에서 라우트 / 모델을 준비하는 비용은 빼고 잰다
+        (await client.post(path, content=body, headers=headers)).raise_for_status()
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = await client.post(path, content=body, headers=headers)
+            response.raise_for_status()
+        return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", nargs="+", default=PATHS)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    import api
+
+    body = json.dumps(BODY, ensure_ascii=False).encode("utf-8")
+    before, after = dict_app(), api.app
+    print(f"requests={args.requests} body={len(body)} bytes")
+    for path in args.paths:
+        before_rate = asyncio.run(rate(before, path, body, args.requests))
+        after_rate = asyncio.run(rate(after, path, body, args.requests))
+        print(f"{path}: dict {before_rate:.0f} req/s -> pre-serialized bytes {after_rate:.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# gunicorn 워커 수(기본 1/2/4)별로 스킬 엔드포인트의 처리량을 잰다.
+#   python bench/worker_throughput.py --workers 1 2 4 --requests 3000 --concurrency 64
+#
+# chroma 인덱스는 이미 만들어져 있다고 보고 (INGEST_BEFORE_FORK=false) 워커만 띄운다.
+# /callback 은 고유한 callbackUrl 로 보내서 공유 SQLite 작업 큐에 쌓이는 속도까지 같이 잰다.
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BODY = {
+    "intent": {"id": "intent", "name": "블록"},
+    "userRequest": {
+        "timezone": "Asia/Seoul",
+        "params": {"surface": "Kakaotalk.plusfriend"},
+        "block": {"id": "block", "name": "블록"},
+        "utterance": "카카오싱크 기능이 뭐야?",
+        "lang": "ko",
+        "user": {"id": "user", "type": "botUserKey", "properties": {"plusfriendUserKey": "key", "isFriend": True}},
+    },
+    "bot": {"id": "bot", "name": "봇"},
+    "action": {"name": "action", "clientExtra": {}, "params": {}, "id": "action", "detailParams": {}},
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_listening(port: int, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start on port {port}")
+
+
+async def _load(port: int, path: str, requests: int, concurrency: int) -> float:
+    url = f"http://127.0.0.1:{port}{path}"
+    counter = iter(range(requests))
+
+    async def client(session: aiohttp.ClientSession):
+        for i in counter:
+            body = {**BODY, "userRequest": {**BODY["userRequest"], "callbackUrl": f"http://127.0.0.1:9/{i}"}}
+            async with session.post(url, json=body) as response:
+                response.raise_for_status()
+                await response.read()
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--paths", nargs="+", default=["/skill/hello", "/callback"])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()} requests={args.requests} concurrency={args.concurrency}")
+    for workers in args.workers:
+        port = _free_port()
+        env = {
+            **os.environ,
+            "INGEST_BEFORE_FORK": "false",
+            "JOB_QUEUE_PATH": os.path.join(tempfile.mkdtemp(), "queue.sqlite3"),
+            "JOB_QUEUE_MAX_DEPTH": str(args.requests * len(args.paths) + 1),
+        }
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--workers", str(workers),
+             "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "api:app"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_until_listening(port)
+            for path in args.paths:
+                rate = asyncio.run(_load(port, path, args.requests, args.concurrency))
+                print(f"workers={workers} {path}: {rate:.0f} req/s")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
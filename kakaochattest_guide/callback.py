@@ -1,26 +1,74 @@
+import asyncio
+import hashlib
+import json
 import logging
 import os
-import time
+import re
+import threading
+from typing import Optional
 
-import aiohttp
 from dotenv import load_dotenv
 from langchain.chains import LLMChain
 from langchain.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferWindowMemory
-from langchain_community.chat_message_histories import FileChatMessageHistory
 from langchain_core.prompts import PromptTemplate
 
+import context_builder
 import db.db
-from dto import ChatbotRequest
-
-load_dotenv()
-os.environ["OPENAI_API_KEY"] = os.environ.get('API_KEY')
+import deadlines
+import db.history
+import http_client
+import intent_router
+import metrics
+import responses
+import streaming
+import tokens
+from answer_cache import ANSWER_CACHE, normalize
+from single_flight import SingleFlight
+from dto import SkillRequest
 
 logger = logging.getLogger("Callback")
 
-db.db.upload_kakao_social_data()
-db.db.upload_kakao_sink_data()
-db.db.upload_kakaotalk_channel_data()
+# local: 임베딩 거리로 intent 를 먼저 고르고 애매할 때만 LLM 호출 / llm: 항상 FIND_INTENT_CHAIN 사용
+INTENT_ROUTER = os.environ.get("INTENT_ROUTER", "local")
+# single: intent 가 정해진 뒤 해당 컬렉션만 검색 / fanout: intent 판단과 동시에 모든 컬렉션을 검색
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "fanout")
+# 가이드 답변을 스트리밍으로 받아 길어지면 문장 단위로 끊고 바로 콜백을 보낸다
+GUIDE_STREAMING = os.environ.get("GUIDE_STREAMING", "true").lower() == "true"
+
+# two_call: intent 판단 후 가이드 답변을 따로 생성 / structured: 검색 후 function calling 한 번으로 intent 와 답변을 함께 받음
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "two_call")
+STRUCTURED_MODEL = os.environ.get("STRUCTURED_MODEL", "gpt-3.5-turbo")
+
+# 체인별 모델. intent / not-found 프롬프트는 짧아서 16k 모델이 필요 없다
+INTENT_MODEL = os.environ.get("INTENT_MODEL", "gpt-3.5-turbo")
+INTENT_NOT_FOUND_MODEL = os.environ.get("INTENT_NOT_FOUND_MODEL", "gpt-3.5-turbo")
+# 가이드 답변은 4k 모델로 먼저 시도하고, 프롬프트가 길 때만 컨텍스트가 큰 모델로 올린다. 비워두면 올리지 않는다
+GUIDE_MODEL = os.environ.get("GUIDE_MODEL", "gpt-3.5-turbo")
+GUIDE_ESCALATION_MODEL = os.environ.get("GUIDE_ESCALATION_MODEL", "gpt-3.5-turbo-16k")
+# 프롬프트가 이보다 길면 처음부터 GUIDE_ESCALATION_MODEL 을 쓴다 (4k 모델에서 답변 자리를 남겨둔 값)
+GUIDE_MODEL_MAX_PROMPT_TOKENS = int(os.environ.get("GUIDE_MODEL_MAX_PROMPT_TOKENS", "3000"))
+# 답변이 비었거나 문서에서 답을 못 찾았다고 하면 이 모델로 다시 묻는다. 16k 모델은 창만 크고 같은 모델이라
+# 다시 물어도 나아지지 않으므로 더 강한 모델(gpt-4 등)을 따로 지정했을 때만 쓴다. 기본은 꺼짐
+GUIDE_LOW_CONFIDENCE_MODEL = os.environ.get("GUIDE_LOW_CONFIDENCE_MODEL", "")
+LOW_CONFIDENCE_PATTERN = re.compile(r"모르겠|알 수 없|찾을 수 없|정보가 없|확인되지 않")
+
+# 동시에 처리할 콜백 수 제한 (LLM / Chroma 호출이 몰려 이벤트 루프가 밀리지 않도록)
+CALLBACK_CONCURRENCY = int(os.environ.get("CALLBACK_CONCURRENCY", "8"))
+_callback_semaphore = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    # 이벤트 루프가 뜬 뒤에 만들어야 하므로 처음 호출될 때 생성
+    global _callback_semaphore
+    if _callback_semaphore is None:
+        _callback_semaphore = asyncio.Semaphore(CALLBACK_CONCURRENCY)
+    return _callback_semaphore
+
+_routes = SingleFlight("route")
+_generations = SingleFlight("generate")
+
+# 인덱스를 `python -m db.ingest` 로 미리 만들어 둔 경우 INGEST_ON_STARTUP=false 로 업로드를 건너뛴다
+INGEST_ON_STARTUP = os.environ.get("INGEST_ON_STARTUP", "true").lower() == "true"
 
 
 def get_prompt(filename):
@@ -28,11 +76,9 @@ def get_prompt(filename):
         return fin.read()
 
 
-llm = ChatOpenAI(temperature=0.1, model='gpt-3.5-turbo-16k')
-
 INTENT_PROMPT = PromptTemplate(
     template=get_prompt("intent_prompt.txt"),
-    input_variables=['intent_list', 'context']
+    input_variables=['intent_list', 'question', 'context']
 )
 
 GUIDE_PROMPT = PromptTemplate(
@@ -45,64 +91,311 @@ INTENT_NOT_FOUND_PROMPT = PromptTemplate(
     input_variables=['question']
 )
 
-FIND_INTENT_CHAIN = LLMChain(llm=llm, prompt=INTENT_PROMPT, verbose=True)
-GUIDE_CHAIN = LLMChain(llm=llm, prompt=GUIDE_PROMPT, verbose=True)
-INTENT_NOT_FOUND_CHAIN = LLMChain(llm=llm, prompt=INTENT_NOT_FOUND_PROMPT, verbose=True)
+STRUCTURED_PROMPT = PromptTemplate(
+    template=get_prompt("structured_prompt.txt"),
+    input_variables=['intent_list', 'related_doc', 'question', 'context']
+)
 
+# LLM / 체인 / chroma 인덱스는 import 시점이 아니라 warm_up() 에서 만든다
+INTENT_LIST = None
+FIND_INTENT_CHAIN = None
+GUIDE_CHAIN = None
+GUIDE_ESCALATION_CHAIN = None
+GUIDE_LOW_CONFIDENCE_CHAIN = None
+INTENT_NOT_FOUND_CHAIN = None
+STRUCTURED_LLM = None
+_warm_up_lock = threading.Lock()
 
-async def callback_handler(request: ChatbotRequest) -> dict:
-    input_text = request.userRequest.utterance
 
-    file_path = os.path.join("history", "test.json")
-    history = FileChatMessageHistory(file_path)
-    context = ConversationBufferWindowMemory(
-        k=3,
-        memory_key="chat_history",
-        input_key="user_message",
-        chat_memory=history,
-    ).buffer
+def is_ready() -> bool:
+    return GUIDE_CHAIN is not None
 
-    intent = FIND_INTENT_CHAIN.run(question=input_text, context=context)
-    logger.info("intent: " + intent)
 
-    if intent == "kakao_social":
-        related_doc = db.db.query_on_kakao_social(input_text)
-        output_text = GUIDE_CHAIN.run(related_doc=related_doc, question=input_text, context=context)
-    elif intent == "kakao_sink":
-        related_doc = db.db.query_on_kakao_sink(input_text)
-        output_text = GUIDE_CHAIN.run(related_doc=related_doc, question=input_text, context=context)
-    elif intent == "kakaotalk_channel":
-        related_doc = db.db.query_on_kakaotalk_channel(input_text)
-        output_text = GUIDE_CHAIN.run(related_doc=related_doc, question=input_text, context=context)
-    else:
-        output_text = INTENT_NOT_FOUND_CHAIN.run(question=input_text)
+def warm_up():
+    """콜백 처리에 필요한 무거운 객체들을 만든다. 여러 번 불러도 한 번만 실행된다."""
+    global INTENT_LIST, FIND_INTENT_CHAIN, GUIDE_CHAIN, GUIDE_ESCALATION_CHAIN, GUIDE_LOW_CONFIDENCE_CHAIN
+    global INTENT_NOT_FOUND_CHAIN, STRUCTURED_LLM
+    with _warm_up_lock:
+        if is_ready():
+            return
+
+        load_dotenv()
+        if os.environ.get('API_KEY'):
+            os.environ["OPENAI_API_KEY"] = os.environ['API_KEY']
+        # tiktoken 인코딩은 처음 쓸 때 파일을 읽고 없으면 내려받는다. 요청 처리 중(이벤트 루프 위) 에 그러지 않도록 미리 불러 둔다
+        tokens.count_tokens("")
+
+        if INGEST_ON_STARTUP:
+            db.db.ingest_all()
+        for intent in db.db.intents():
+            db.db.get_collection(intent)
+            db.db.get_lexical_index(intent)
+
+        INTENT_LIST = "\n".join(f"{config['intent']}: {config['description']}" for config in db.db.load_registry())
+        FIND_INTENT_CHAIN = LLMChain(
+            llm=ChatOpenAI(temperature=0.1, model=INTENT_MODEL), prompt=INTENT_PROMPT, verbose=True
+        )
+        INTENT_NOT_FOUND_CHAIN = LLMChain(
+            llm=ChatOpenAI(temperature=0.1, model=INTENT_NOT_FOUND_MODEL), prompt=INTENT_NOT_FOUND_PROMPT, verbose=True
+        )
+        if PIPELINE_MODE == "structured":
+            STRUCTURED_LLM = ChatOpenAI(temperature=0.1, model=STRUCTURED_MODEL).bind(
+                functions=[_answer_function()], function_call={"name": "answer_question"}
+            )
+        if GUIDE_ESCALATION_MODEL and GUIDE_ESCALATION_MODEL != GUIDE_MODEL:
+            GUIDE_ESCALATION_CHAIN = LLMChain(
+                llm=ChatOpenAI(temperature=0.1, model=GUIDE_ESCALATION_MODEL, streaming=GUIDE_STREAMING),
+                prompt=GUIDE_PROMPT,
+                verbose=True,
+            )
+        if GUIDE_LOW_CONFIDENCE_MODEL and GUIDE_LOW_CONFIDENCE_MODEL != GUIDE_MODEL:
+            GUIDE_LOW_CONFIDENCE_CHAIN = LLMChain(
+                llm=ChatOpenAI(temperature=0.1, model=GUIDE_LOW_CONFIDENCE_MODEL, streaming=GUIDE_STREAMING),
+                prompt=GUIDE_PROMPT,
+                verbose=True,
+            )
+        GUIDE_CHAIN = LLMChain(
+            llm=ChatOpenAI(temperature=0.1, model=GUIDE_MODEL, streaming=GUIDE_STREAMING), prompt=GUIDE_PROMPT, verbose=True
+        )
 
-    logger.info(f"답변: {output_text}")
 
-    history.add_user_message(input_text)
-    history.add_ai_message(output_text)
-
-    payload = {
-        "version": "2.0",
-        "template": {
-            "outputs": [
-                {
-                    "simpleText": {
-                        "text": output_text
-                    }
-                }
-            ]
-        }
+def _answer_function() -> dict:
+    return {
+        "name": "answer_question",
+        "description": "Return the intent of the user's question and the answer to it",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "intent": {"type": "string", "enum": db.db.intents() + ["none"]},
+                "answer": {"type": "string", "description": "Answer in Korean. Empty if the intent is none"},
+            },
+            "required": ["intent", "answer"],
+        },
     }
-    # ===================== end =================================
-    # 참고링크1 : https://kakaobusiness.gitbook.io/main/tool/chatbot/skill_guide/ai_chatbot_callback_guide
-    # 참고링크1 : https://kakaobusiness.gitbook.io/main/tool/chatbot/skill_guide/answer_json_format
 
-    time.sleep(1.0)
 
+async def _run_chain(name: str, chain: LLMChain, stream: bool = False, **inputs) -> str:
+    model = chain.llm.model_name
+    with metrics.stage(name), metrics.LLM_CALL_SECONDS.time(chain=name, model=model):
+        if stream:
+            result = await deadlines.run(name, streaming.stream_chain(chain, **inputs))
+            metrics.GUIDE_TIME_TO_FIRST_TOKEN_SECONDS.observe(result.time_to_first_token)
+            metrics.GUIDE_TOTAL_SECONDS.observe(result.total_time)
+            output_text = result.text
+        else:
+            output_text = await deadlines.run(name, chain.arun(**inputs))
+
+    prompt_tokens = tokens.count_tokens(chain.prompt.format(**inputs))
+    logger.info(f"{name} ({model}) prompt tokens: {prompt_tokens}")
+    metrics.LLM_TOKENS.inc(prompt_tokens, chain=name, model=model, kind="prompt")
+    metrics.LLM_TOKENS.inc(tokens.count_tokens(output_text), chain=name, model=model, kind="completion")
+    return output_text
+
+
+async def _run_guide(**inputs) -> str:
+    """4k 모델로 먼저 답한다. 프롬프트가 길면 큰 컨텍스트 모델로, 답이 미덥지 않으면 (설정했을 때만) 더 강한 모델로 올린다."""
+    if GUIDE_ESCALATION_CHAIN is not None and tokens.count_tokens(GUIDE_PROMPT.format(**inputs)) > GUIDE_MODEL_MAX_PROMPT_TOKENS:
+        metrics.GUIDE_ESCALATIONS.inc(reason="prompt_tokens")
+        return await _run_chain("guide", GUIDE_ESCALATION_CHAIN, stream=GUIDE_STREAMING, **inputs)
+
+    output_text = await _run_chain("guide", GUIDE_CHAIN, stream=GUIDE_STREAMING, **inputs)
+    if GUIDE_LOW_CONFIDENCE_CHAIN is None:
+        return output_text
+    if output_text.strip() and not LOW_CONFIDENCE_PATTERN.search(output_text):
+        return output_text
+    if deadlines.remaining() < deadlines.DEADLINE_FALLBACK_SECONDS:
+        # 강한 모델을 기다릴 시간이 없으면 처음 답변을 그대로 보낸다
+        return output_text
+    metrics.GUIDE_ESCALATIONS.inc(reason="low_confidence")
+    return await _run_chain("guide", GUIDE_LOW_CONFIDENCE_CHAIN, stream=GUIDE_STREAMING, **inputs)
+
+
+def _timed(stage: str, func, *args):
+    # 스레드에서 실행되는 동기 함수의 소요 시간을 잰다
+    with metrics.stage(stage):
+        return func(*args)
+
+
+async def _in_thread(stage: str, func, *args):
+    # 스레드 작업은 중간에 멈출 수 없으므로 제한 시간이 지나면 결과를 기다리지 않고 포기한다
+    return await deadlines.run(stage, asyncio.to_thread(_timed, stage, func, *args))
+
+
+async def _answer(input_text: str, context: str) -> str:
+    # 캠페인 직후처럼 같은 질문이 동시에 몰리면 intent 판단과 답변 생성을 한 번만 돌리고 결과를 나눠 쓴다
+    question = normalize(input_text)
+    context_key = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    if PIPELINE_MODE == "structured":
+        output_text = await _generations.do(
+            (question, "structured", context_key), lambda: _answer_structured(input_text, context)
+        )
+        if output_text is not None:
+            return output_text
+    intent, hits = await _routes.do(
+        (question, context_key), lambda: _route(input_text, context)
+    )
+    return await _generations.do(
+        (question, intent, context_key), lambda: _generate(input_text, context, intent, hits)
+    )
+
+
+async def _answer_structured(input_text: str, context: str) -> Optional[str]:
+    """모든 컬렉션을 먼저 검색하고, 한 번의 function call 로 intent 와 답변을 함께 받는다.
+
+    intent 가 none 이면 기존 not-found 체인으로 답한다. 응답을 해석할 수 없으면 None (두 번 호출하는 경로로 넘어감).
+    """
+    hits = await _in_thread("retrieval", db.db.query_all, input_text)
+    inputs = dict(
+        intent_list=INTENT_LIST, related_doc=context_builder.build_related_doc(hits), question=input_text, context=context
+    )
+    prompt = STRUCTURED_PROMPT.format(**inputs)
+    model = STRUCTURED_MODEL
+    with metrics.stage("structured"), metrics.LLM_CALL_SECONDS.time(chain="structured", model=model):
+        message = await deadlines.run("structured", STRUCTURED_LLM.ainvoke(prompt))
+
+    function_call = message.additional_kwargs.get("function_call") or {}
+    arguments = function_call.get("arguments", "")
+    prompt_tokens = tokens.count_tokens(prompt)
+    logger.info(f"structured ({model}) prompt tokens: {prompt_tokens}")
+    metrics.LLM_TOKENS.inc(prompt_tokens, chain="structured", model=model, kind="prompt")
+    metrics.LLM_TOKENS.inc(tokens.count_tokens(arguments), chain="structured", model=model, kind="completion")
+
+    try:
+        result = json.loads(arguments)
+        intent, answer = result["intent"], result["answer"]
+    except (ValueError, KeyError, TypeError):
+        logger.warning(f"unexpected structured response: {function_call!r}")
+        return None
+    logger.info("intent: " + intent)
+
+    if intent not in db.db.intents():
+        return await _run_chain("intent_not_found", INTENT_NOT_FOUND_CHAIN, question=input_text)
+    return answer if answer.strip() else None
+
+
+async def _route(input_text: str, context: str) -> tuple[str, Optional[list[dict]]]:
+    """intent 와, fanout 모드라면 그 intent 에 맞춰 고른 검색 결과를 돌려준다."""
+    retrieval = None
+    if RETRIEVAL_MODE == "fanout":
+        # intent 별 거리와 intent 컬렉션의 문서가 필요하므로 합친 결과를 자르지 않고 받는다
+        retrieval = asyncio.ensure_future(
+            _in_thread("retrieval", db.db.query_all, input_text, None, db.db.RETRIEVAL_RESULTS)
+        )
+
+    intent = None
+    if INTENT_ROUTER == "local":
+        if retrieval is not None:
+            intent = intent_router.route(input_text, db.db.best_distances(await retrieval))
+        else:
+            intent = await _in_thread("intent_router", intent_router.route, input_text)
+    if intent is None:
+        intent = (await _run_chain(
+            "intent", FIND_INTENT_CHAIN, intent_list=INTENT_LIST, question=input_text, context=context
+        )).strip()
+    logger.info("intent: " + intent)
+
+    if retrieval is None:
+        return intent, None
+    if intent not in db.db.intents():
+        retrieval.cancel()
+        return intent, None
+    return intent, db.db.related_hits(await retrieval, intent)
+
+
+async def _generate(input_text: str, context: str, intent: str, hits: Optional[list[dict]]) -> str:
+    if intent in db.db.intents():
+        if hits is None:
+            # Chroma 쿼리는 동기 API 이므로 스레드에서 실행
+            hits = await _in_thread("retrieval", db.db.query, intent, input_text)
+        related_doc = context_builder.build_related_doc(hits)
+        return await _run_guide(related_doc=related_doc, question=input_text, context=context)
+    return await _run_chain("intent_not_found", INTENT_NOT_FOUND_CHAIN, question=input_text)
+
+
+FALLBACK_TEXT = "지금은 답변이 늦어지고 있어요😢 잠시 후 다시 물어봐 주세요!"
+
+
+async def respond(request: SkillRequest, deadline: Optional[float] = None) -> Optional[dict]:
+    """답변을 만들어 스킬 응답 payload 로 돌려준다. 콜백 전송은 하지 않는다.
+
+    deadline(time.time() 기준) 이 이미 지났으면 None. 단계가 제한 시간을 넘기면 준비된 문구로 답한다.
+    """
+    if not is_ready():
+        await asyncio.to_thread(warm_up)
+    with deadlines.scope(deadline):
+        async with _get_semaphore():
+            # 자리가 나길 기다리는 동안 마감이 지났을 수도 있다
+            if deadlines.remaining() <= 0:
+                deadlines.CALLBACK_DEADLINES.inc(result="expired")
+                return None
+            metrics.CALLBACK_IN_FLIGHT.inc()
+            try:
+                return await _respond(request)
+            except deadlines.DeadlineExceeded as e:
+                logger.warning(f"stage {e} timed out, {deadlines.remaining():.1f}s left")
+                deadlines.CALLBACK_DEADLINES.inc(result="timeout")
+                return responses.skill_response([responses.simple_text(FALLBACK_TEXT)])
+            finally:
+                metrics.CALLBACK_IN_FLIGHT.dec()
+
+
+async def post_answer(request: SkillRequest, payload: dict, deadline: Optional[float] = None):
+    # 참고링크1 : https://kakaobusiness.gitbook.io/main/tool/chatbot/skill_guide/ai_chatbot_callback_guide
+    # 참고링크1 : https://kakaobusiness.gitbook.io/main/tool/chatbot/skill_guide/answer_json_format
     url = request.userRequest.callbackUrl
 
     if url:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=url, json=payload, ssl=False) as resp:
-                await resp.json()
+        with deadlines.scope(deadline), metrics.stage("callback_post"):
+            try:
+                await deadlines.run("callback_post", http_client.post_callback(url, payload))
+            except deadlines.DeadlineExceeded:
+                # 만료된 callbackUrl 로는 보내지 않는다
+                deadlines.CALLBACK_DEADLINES.inc(result="expired")
+                logger.warning("callback deadline passed before the answer was sent")
+
+
+async def callback_handler(request: SkillRequest, deadline: Optional[float] = None):
+    payload = await respond(request, deadline)
+    if payload is not None:
+        await post_answer(request, payload, deadline)
+
+
+async def _respond(request: SkillRequest) -> dict:
+    input_text = request.userRequest.utterance
+
+    history = db.history.SQLiteChatMessageHistory(request.userRequest.user.id, k=3)
+
+    # 오래된 대화는 토큰 예산을 넘으면 버린다
+    messages = await _in_thread("history_load", lambda: history.messages)
+    context = context_builder.build_history(messages)
+
+    # 이전 대화까지 같고 같은(비슷한) 질문이면 LLM 을 부르지 않고 캐시된 답변을 바로 쓴다
+    output_text = await asyncio.to_thread(ANSWER_CACHE.get, input_text, context)
+    if output_text is None and deadlines.remaining() < deadlines.DEADLINE_FALLBACK_SECONDS:
+        # 캐시에도 없고 LLM 답변을 기다릴 시간도 없으면 준비된 문구로 답한다
+        deadlines.CALLBACK_DEADLINES.inc(result="fallback")
+        return responses.skill_response([responses.simple_text(FALLBACK_TEXT)])
+    if output_text is None:
+        metrics.ANSWER_CACHE_REQUESTS.inc(result="miss")
+        output_text = await _answer(input_text, context)
+        await asyncio.to_thread(ANSWER_CACHE.put, input_text, output_text, context)
+    else:
+        metrics.ANSWER_CACHE_REQUESTS.inc(result="hit")
+        logger.info("answer cache hit")
+
+    logger.info(f"답변: {output_text}")
+
+    def _save_history():
+        history.add_user_message(input_text)
+        history.add_ai_message(output_text)
+
+    try:
+        await _in_thread("history_write", _save_history)
+    except deadlines.DeadlineExceeded:
+        # 답변은 이미 만들어졌으므로 대화 기록을 못 남겨도 그대로 보낸다
+        logger.warning("history write timed out, answer is sent without saving the turn")
+        deadlines.CALLBACK_DEADLINES.inc(result="history_timeout")
+
+    return responses.skill_response(
+        [responses.simple_text(text) for text in streaming.split_outputs(output_text)]
+    )
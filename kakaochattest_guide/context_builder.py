@@ -0,0 +1,52 @@
+import os
+
+from langchain_core.messages import BaseMessage
+
+import tokens
+
+# GUIDE_PROMPT 의 {related_doc} / {context} 에 넣을 최대 토큰 수
+RELATED_DOC_TOKENS = int(os.environ.get("RELATED_DOC_TOKENS", "1200"))
+HISTORY_TOKENS = int(os.environ.get("HISTORY_TOKENS", "400"))
+
+
+def build_related_doc(hits: list[dict], budget: int = RELATED_DOC_TOKENS) -> str:
+    """검색 순위대로 예산 안에서 담는다. 겹치는 청크에서 이미 들어간 줄은 뺀다."""
+    sections = {}  # title -> 줄 목록, 먼저 들어간 (더 가까운) 섹션 순서를 유지
+    seen_lines = set()
+    used = 0
+
+    for hit in hits:
+        title = hit["metadata"]["title"] if hit.get("metadata") else ""
+        text = hit["document"]
+        if title and text.startswith(f"{title} : "):
+            text = text[len(title) + 3:]
+
+        for line in text.split("\n"):
+            line = line.strip()
+            if not line or line in seen_lines:
+                continue
+            line_tokens = tokens.count_tokens(line)
+            if used + line_tokens > budget:
+                break
+            seen_lines.add(line)
+            sections.setdefault(title, []).append(line)
+            used += line_tokens
+
+    return "\n\n".join(
+        (f"[{title}]\n" if title else "") + "\n".join(lines) for title, lines in sections.items()
+    )
+
+
+def build_history(messages: list[BaseMessage], budget: int = HISTORY_TOKENS) -> str:
+    """최근 대화부터 거꾸로 담고, 예산을 넘는 오래된 턴은 버린다."""
+    lines = []
+    used = 0
+    for message in reversed(messages):
+        speaker = "User" if message.type == "human" else "AI"
+        line = f"{speaker}: {message.content}"
+        line_tokens = tokens.count_tokens(line)
+        if used + line_tokens > budget:
+            break
+        lines.insert(0, line)
+        used += line_tokens
+    return "\n".join(lines)
@@ -1,107 +1,396 @@
+import fcntl
+import functools
+import hashlib
 import json
+import logging
+import os
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
 
 import chromadb
 from chromadb.api.models import Collection
-from langchain_community.document_loaders import TextLoader
+from chromadb.utils import embedding_functions
+
+import tokens
+from db.embedding_cache import CachedEmbeddingFunction
+from db.lexical import LexicalIndex
+
+logger = logging.getLogger("DB")
 
 CHROMA_PERSIST_PATH = "chroma"
-KAKAO_SOCIAL_COLLECTION_NAME = "kakao-social-collection"
-KAKAO_SINK_COLLECTION_NAME = "kakao-sink-collection"
-KAKAOTALK_CHANNEL_COLLECTION_NAME = "kakaotalk-channel-collection"
+# 검색 결과 로그는 요청마다 남기면 I/O 가 커서 일부만 샘플링한다
+DB_LOG_SAMPLE_RATE = float(os.environ.get("DB_LOG_SAMPLE_RATE", "0.01"))
+# 섹션을 이 토큰 수 이하의 청크로 나누고, 이웃 청크는 일부 겹치게 저장한다
+CHUNK_TOKENS = int(os.environ.get("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "48"))
+# 검색해서 가져올 청크 수. 프롬프트에 들어가는 양은 context_builder 의 토큰 예산으로 다시 자른다
+RETRIEVAL_RESULTS = int(os.environ.get("RETRIEVAL_RESULTS", "5"))
+# 벡터 검색 결과와 BM25 결과를 reciprocal rank fusion 으로 합친다
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "true").lower() == "true"
+LEXICAL_INDEX_PATH = os.path.join(CHROMA_PERSIST_PATH, "lexical")
+EMBEDDING_CACHE_PATH = os.path.join(CHROMA_PERSIST_PATH, "embedding-cache")
+RRF_K = 60
+# intent / 컬렉션 이름 / 데이터 파일 목록. 새 카카오 상품은 이 파일에 한 줄 추가하면 된다
+COLLECTIONS_CONFIG_PATH = os.environ.get(
+    "COLLECTIONS_CONFIG_PATH", os.path.join(os.path.dirname(__file__), "collections.json")
+)
+# 컬렉션별로 섹션 id -> 내용 해시를 기록해 두고 바뀐 섹션만 다시 임베딩한다
+MANIFEST_PATH = os.path.join(CHROMA_PERSIST_PATH, "manifest.json")
+# 여러 프로세스가 동시에 ingest_all() 을 부르면 이 파일 락으로 한 번에 하나씩만 쓰게 한다
+INGEST_LOCK_PATH = os.path.join(CHROMA_PERSIST_PATH, ".ingest.lock")
+# gunicorn 워커처럼 인덱스를 읽기만 하는 프로세스. 컬렉션을 만들거나 업로드하지 않는다
+CHROMA_READ_ONLY = os.environ.get("CHROMA_READ_ONLY", "false").lower() == "true"
+
+_lock = threading.Lock()
+_client = None
+_embedding_function = None
+_collections = {}
+_lexical_indexes = {}
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chroma-query")
+
+
+def _get_client():
+    # 프로세스당 클라이언트 하나만 만들어서 모든 컬렉션이 공유한다
+    global _client
+    with _lock:
+        if _client is None:
+            _client = chromadb.PersistentClient(path=CHROMA_PERSIST_PATH)
+        return _client
+
+
+def get_embedding_function():
+    # 컬렉션과 캐시가 같은 임베딩 모델을 쓰도록 하나만 만들어 공유한다
+    global _embedding_function
+    with _lock:
+        if _embedding_function is None:
+            # 질문 임베딩은 이 프로세스 메모리에만 캐시한다. 디스크 캐시는 ingest 단계만 쓴다
+            _embedding_function = CachedEmbeddingFunction(embedding_functions.DefaultEmbeddingFunction())
+        return _embedding_function
+
+
+def embed(texts: list[str]) -> list:
+    return get_embedding_function()(texts)
 
 
 def _createCollection(collection_name: str):
-    return chromadb.PersistentClient().get_or_create_collection(
+    if CHROMA_READ_ONLY:
+        # 인덱스가 없으면 여기서 실패한다. `python -m db.ingest` 를 먼저 돌려야 한다
+        return _get_client().get_collection(name=collection_name, embedding_function=get_embedding_function())
+    return _get_client().get_or_create_collection(
         name=collection_name,
-        metadata={"hnsw:space": "cosine"}
+        metadata={"hnsw:space": "cosine"},
+        embedding_function=get_embedding_function(),
     )
 
 
-kakao_social_collection = _createCollection(KAKAO_SOCIAL_COLLECTION_NAME)
-kakao_sink_collection = _createCollection(KAKAO_SINK_COLLECTION_NAME)
-kakaotalk_channel_collection = _createCollection(KAKAOTALK_CHANNEL_COLLECTION_NAME)
+@functools.lru_cache(maxsize=None)
+def load_registry() -> list[dict]:
+    with open(COLLECTIONS_CONFIG_PATH, "r") as f:
+        return json.load(f)
+
+
+def intents() -> list[str]:
+    return [config["intent"] for config in load_registry()]
+
 
+def _get_config(intent: str) -> dict:
+    for config in load_registry():
+        if config["intent"] == intent:
+            return config
+    raise KeyError(f"Unknown intent: {intent}")
 
-def _text_to_json(file_path: str):
-    loader = {
-        "txt": TextLoader,
-    }.get(file_path.split(".")[-1])
 
-    if loader is None:
+def get_collection(intent: str) -> Collection:
+    collection = _collections.get(intent)
+    if collection is None:
+        collection = _collections[intent] = _createCollection(_get_config(intent)["name"])
+    return collection
+
+
+def corpus_version() -> str:
+    # data 파일이 바뀌면 값이 달라진다. 파일 stat 만 보므로 요청마다 불러도 부담이 없다
+    digest = hashlib.sha256()
+    for config in load_registry():
+        stat = os.stat(config["data_file"])
+        digest.update(f"{config['data_file']}:{stat.st_mtime_ns}:{stat.st_size};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _read_sections(file_path: str):
+    # 파일을 한 줄씩 읽으면서 '#' 으로 시작하는 줄을 기준으로 (제목, 본문 줄 목록) 을 만든다
+    if not file_path.endswith(".txt"):
         raise ValueError("Not supported file type")
 
-    f = open(file_path, "r")
-    full_txt = f.read()
+    title, lines = None, []
+    with open(file_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#"):
+                if title and lines:
+                    yield title, lines
+                title, lines = line.lstrip("#").strip(), []
+            elif line and title is not None:
+                lines.append(line)
+    if title and lines:
+        yield title, lines
 
-    json_file = []
-    for txt in full_txt.split('\n#'):
-        t = [i for i in txt.split('\n') if i != '']
-        if len(t) <= 1:
-            continue
-        json_file.append({
-            "Title": t[0],
-            "Description": ''.join(t[1:])
-        })
 
-    res = json.dumps(json_file, ensure_ascii=False)
-    return json.loads(res)
+def _split_units(lines: list[str]) -> list[str]:
+    # 청크를 나누고 겹치게 하는 최소 단위는 문장이다. 본문 한 줄이 겹침 예산보다 긴 경우가 대부분이라
+    # 줄 단위로는 이웃 청크가 거의 겹치지 않는다
+    return [sentence for line in lines for sentence in re.split(r"(?<=[.!?])\s+", line) if sentence]
 
 
-def upload_kakao_social_data():
-    print("카카오소셜 chroma에 업로드...")
-    file_path = './data/카카오소셜.txt'
-    data = _text_to_json(file_path=file_path)
-    _upload(kakao_social_collection, data)
+def _overlap(chunk: list[str]) -> list[str]:
+    # 앞 청크의 끝에서 CHUNK_OVERLAP_TOKENS 만큼을 문장 단위로 가져온다.
+    # 마지막 문장 하나가 그보다 길면 그 문장의 뒷부분을 토큰 단위로 자르되 단어 중간에서 시작하지 않게 한다
+    overlap, overlap_tokens = [], 0
+    for previous in reversed(chunk):
+        previous_tokens = tokens.count_tokens(previous)
+        if overlap_tokens + previous_tokens > CHUNK_OVERLAP_TOKENS:
+            if not overlap:
+                part = tokens.tail(previous, CHUNK_OVERLAP_TOKENS)
+                part = part[part.find(" ") + 1:].strip()
+                if part:
+                    overlap.append(part)
+            break
+        overlap.insert(0, previous)
+        overlap_tokens += previous_tokens
+    return overlap
 
 
-def upload_kakao_sink_data():
-    print("카카오싱크 chroma에 업로드...")
-    file_path = './data/카카오싱크.txt'
-    data = _text_to_json(file_path=file_path)
-    _upload(kakao_sink_collection, data)
+def _chunk_section(lines: list[str]):
+    """섹션 본문을 CHUNK_TOKENS 크기로 나누고, 이웃 청크끼리 CHUNK_OVERLAP_TOKENS 만큼 겹치게 한다."""
+    chunk, chunk_tokens = [], 0
+    fresh = False  # 겹침으로 가져온 부분 말고 새 문장이 들어 있는지
+    for unit in _split_units(lines):
+        unit_tokens = tokens.count_tokens(unit)
+        if fresh and chunk_tokens + unit_tokens > CHUNK_TOKENS:
+            yield "\n".join(chunk)
+            # 앞 청크의 끝부분을 다음 청크 앞에 다시 붙인다
+            chunk = _overlap(chunk)
+            chunk_tokens = sum(tokens.count_tokens(part) for part in chunk)
+        chunk.append(unit)
+        chunk_tokens += unit_tokens
+        fresh = True
+    if fresh:
+        yield "\n".join(chunk)
 
 
-def upload_kakaotalk_channel_data():
-    print("카카오톡 채널 chroma에 업로드...")
-    file_path = './data/카카오톡채널.txt'
-    data = _text_to_json(file_path=file_path)
-    _upload(kakaotalk_channel_collection, data)
+def _load_chunks(file_path: str) -> list[dict]:
+    chunks = []
+    seen_titles = {}
+    for title, lines in _read_sections(file_path):
+        # 같은 제목이 여러 번 나와도 id 가 겹치지 않도록 순번을 붙인다
+        slug = re.sub(r"\s+", "-", title)
+        seen_titles[slug] = seen_titles.get(slug, 0) + 1
+        if seen_titles[slug] > 1:
+            slug = f"{slug}-{seen_titles[slug]}"
 
+        for i, text in enumerate(_chunk_section(lines)):
+            chunks.append({
+                "id": f"{slug}#{i}",
+                "document": f"{title} : {text}",
+                "metadata": {"title": title, "chunk": i},
+            })
+    return chunks
 
-def _upload(collection: Collection, data: json):
-    # 데이터 준비
-    ids = []  # 인덱스
-    documents = []  # 벡터로 변환 저장할 텍스트 데이터로 ChromaDB에 Embedding 데이터가 없으면 자동으로 벡터로 변환해서 저장
 
-    for item in data:
-        id = item['Title'].replace(' ', '-')
-        document = f"{item['Title'].strip()} : {item['Description'].strip()}"
+def upload(intent: str, embedding_function: Optional[CachedEmbeddingFunction] = None):
+    if CHROMA_READ_ONLY:
+        raise RuntimeError("CHROMA_READ_ONLY 프로세스에서는 업로드할 수 없습니다")
+    config = _get_config(intent)
+    logger.info(f"{config['name']} chroma에 업로드...")
+    chunks = _load_chunks(config["data_file"])
+    _upload(get_collection(intent), chunks, embedding_function or get_embedding_function())
 
-        ids.append(id)
-        documents.append(document)
+    # 같은 청크로 BM25 인덱스도 만들어 chroma 옆에 저장
+    index = LexicalIndex.build(chunks)
+    index.save(_lexical_index_path(config["name"]))
+    _lexical_indexes[intent] = index
 
-    collection.add(
-        documents=documents,
-        ids=ids
-    )
+
+def _lexical_index_path(collection_name: str) -> str:
+    return os.path.join(LEXICAL_INDEX_PATH, f"{collection_name}.json")
+
+
+def get_lexical_index(intent: str):
+    if intent not in _lexical_indexes:
+        path = _lexical_index_path(_get_config(intent)["name"])
+        _lexical_indexes[intent] = LexicalIndex.load(path) if os.path.exists(path) else None
+    return _lexical_indexes[intent]
+
+
+@contextmanager
+def _ingest_lock():
+    os.makedirs(os.path.dirname(INGEST_LOCK_PATH), exist_ok=True)
+    with open(INGEST_LOCK_PATH, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def ingest_all():
+    # 먼저 락을 잡은 프로세스가 업로드하고, 뒤에 온 프로세스는 manifest 를 보고 바뀐 게 없으면 그냥 지나간다
+    with _ingest_lock():
+        # 같은 청크는 디스크 캐시에서 벡터를 꺼내 모델 호출을 건너뛴다. 락을 잡은 이 프로세스만 파일에 쓴다
+        embedding_function = CachedEmbeddingFunction(
+            get_embedding_function().embedding_function, EMBEDDING_CACHE_PATH
+        )
+        for intent in intents():
+            upload(intent, embedding_function)
+        embedding_function.flush()
 
 
-def query_on_kakao_social(query: str) -> list[str]:
-    return _query_db(kakao_social_collection, query)
+def _load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH, "r") as f:
+        return json.load(f)
 
 
-def query_on_kakao_sink(query: str) -> list[str]:
-    return _query_db(kakao_sink_collection, query)
+def _save_manifest(manifest: dict):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
 
 
-def query_on_kakaotalk_channel(query: str) -> list[str]:
-    return _query_db(kakaotalk_channel_collection, query)
+def _upload(collection: Collection, chunks: list[dict], embedding_function: CachedEmbeddingFunction):
+    # 벡터로 변환 저장할 텍스트 데이터로 ChromaDB에 Embedding 데이터가 없으면 자동으로 벡터로 변환해서 저장
+    chunks = {chunk["id"]: chunk for chunk in chunks}
+    hashes = {
+        id: hashlib.sha256(json.dumps([chunk["document"], chunk["metadata"]], ensure_ascii=False).encode("utf-8")).hexdigest()
+        for id, chunk in chunks.items()
+    }
 
+    manifest = _load_manifest()
+    # manifest 가 없거나 실제 인덱스와 어긋나 있을 수 있으므로 지울 대상은 인덱스에 실제로 있는 id 로 정한다
+    # (예전 id 체계로 올라간 섹션 단위 문서도 여기서 지워진다)
+    existing = set(collection.get(include=[])["ids"])
+    previous = {id: digest for id, digest in manifest.get(collection.name, {}).items() if id in existing}
 
-def _query_db(collection: Collection, query: str) -> list[str]:
+    changed = [id for id, digest in hashes.items() if previous.get(id) != digest]
+    removed = [id for id in existing if id not in hashes]
+
+    if changed:
+        documents = [chunks[id]["document"] for id in changed]
+        collection.upsert(
+            embeddings=embedding_function(documents),
+            documents=documents,
+            metadatas=[chunks[id]["metadata"] for id in changed],
+            ids=changed
+        )
+    if removed:
+        collection.delete(ids=removed)
+
+    logger.info(f"{collection.name}: {len(changed)}개 업데이트, {len(removed)}개 삭제, {len(hashes) - len(changed)}개 유지")
+    manifest[collection.name] = hashes
+    _save_manifest(manifest)
+
+
+def query(intent: str, query: str, n_results: int = RETRIEVAL_RESULTS) -> list[dict]:
+    return query_many(intent, [query], n_results)[0]
+
+
+def query_many(intent: str, queries: list[str], n_results: int = RETRIEVAL_RESULTS) -> list[list[dict]]:
+    """여러 질문을 한 번에 임베딩하고 한 번의 chroma 쿼리로 검색한다. 질문 순서대로 결과를 돌려준다."""
+    return [_fuse(hits)[:n_results] for hits in _query_db(intent, queries, embed(queries), n_results)]
+
+
+def _log_search(collection_name: str, docs: dict):
+    if random.random() >= DB_LOG_SAMPLE_RATE or not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(json.dumps({
+        "event": "vector_search",
+        "collection": collection_name,
+        "ids": docs["ids"][0],
+        "distances": [round(distance, 4) for distance in docs["distances"][0]],
+    }, ensure_ascii=False))
+
+
+def query_all(query: str, n_results: Optional[int] = RETRIEVAL_RESULTS, per_collection: Optional[int] = None) -> list[dict]:
+    return query_many_all([query], n_results, per_collection)[0]
+
+
+def query_many_all(
+    queries: list[str], n_results: Optional[int] = RETRIEVAL_RESULTS, per_collection: Optional[int] = None
+) -> list[list[dict]]:
+    """질문들을 한 번만 임베딩하고 모든 컬렉션을 동시에 검색해서 질문별로 합친 상위 n_results 개를 돌려준다.
+
+    컬렉션마다 per_collection 개 (기본 n_results) 씩 찾는다. intent 를 고르기 전처럼 컬렉션별 결과가
+    모두 필요하면 n_results=None 으로 자르지 않은 결과를 받는다.
+    """
+    per_collection = per_collection or n_results
+    query_embeddings = embed(queries)
+    futures = [_executor.submit(_query_db, intent, queries, query_embeddings, per_collection) for intent in intents()]
+    per_collection_hits = [future.result() for future in futures]
+    return [
+        _fuse([hit for hits in per_collection_hits for hit in hits[i]])[:n_results] for i in range(len(queries))
+    ]
+
+
+def _query_db(intent: str, queries: list[str], query_embeddings: list, n_results: int) -> list[list[dict]]:
+    collection = get_collection(intent)
     docs = collection.query(  # collection.similarity_search(query)
-        query_texts=[query],
-        n_results=3,
+        query_embeddings=query_embeddings,
+        n_results=n_results,
     )
-    print(f"vector search result: {docs['documents'][0]}")
-    return docs["documents"][0]
+    _log_search(collection.name, docs)
+
+    index = get_lexical_index(intent) if HYBRID_RETRIEVAL else None
+    results = []
+    for i, query in enumerate(queries):
+        hits = {
+            id: {"intent": intent, "id": id, "document": document, "metadata": metadata, "distance": distance, "bm25": 0.0}
+            for id, document, metadata, distance in zip(
+                docs["ids"][i], docs["documents"][i], docs["metadatas"][i], docs["distances"][i]
+            )
+        }
+        if index is not None:
+            for hit in index.search(query, n_results):
+                if hit["id"] in hits:
+                    hits[hit["id"]]["bm25"] = hit["bm25"]
+                else:
+                    hits[hit["id"]] = {"intent": intent, "distance": float("inf"), **hit}
+        results.append(list(hits.values()))
+    return results
+
+
+def _fuse(hits: list[dict]) -> list[dict]:
+    # 벡터 거리 순위와 BM25 점수 순위를 reciprocal rank fusion 으로 합쳐 정렬한다
+    for hit in hits:
+        hit["score"] = 0.0
+    by_distance = sorted((hit for hit in hits if hit["distance"] != float("inf")), key=lambda hit: hit["distance"])
+    by_bm25 = sorted((hit for hit in hits if hit["bm25"] > 0), key=lambda hit: hit["bm25"], reverse=True)
+    for ranking in (by_distance, by_bm25):
+        for rank, hit in enumerate(ranking):
+            hit["score"] += 1 / (RRF_K + rank + 1)
+    return sorted(hits, key=lambda hit: (-hit["score"], hit["distance"]))
+
+
+def related_hits(hits: list[dict], intent: str, n_results: int = RETRIEVAL_RESULTS) -> list[dict]:
+    # 다른 상품 문서가 더 가까우면 같이 넣되, intent 컬렉션의 문서는 최소 하나 포함한다.
+    # hits 는 컬렉션별 결과를 자르지 않은 query_all(..., n_results=None) 의 결과다
+    selected = hits[:n_results]
+    if not any(hit["intent"] == intent for hit in selected):
+        selected = selected[:n_results - 1] + [hit for hit in hits if hit["intent"] == intent][:1]
+    return selected
+
+
+def intent_distances(query: str) -> dict[str, float]:
+    return best_distances(query_all(query, n_results=None, per_collection=1))
+
+
+def best_distances(hits: list[dict]) -> dict[str, float]:
+    distances = {intent: float("inf") for intent in intents()}
+    for hit in hits:
+        distances[hit["intent"]] = min(distances[hit["intent"]], hit["distance"])
+    return distances
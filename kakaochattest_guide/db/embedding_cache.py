@@ -0,0 +1,126 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "20000"))
+_KEY_BYTES = 32  # sha256
+
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """텍스트 해시 -> 벡터 캐시. 같은 문서/질문은 임베딩 모델을 다시 돌리지 않는다.
+
+    path 가 없으면 이 프로세스 메모리에만 둔다. path 가 있으면 벡터는 path.npy, 슬롯별 텍스트 해시는
+    path.keys.npy 에 memmap 으로 두고 바뀐 슬롯만 쓴다. 파일에 쓰는 프로세스는 하나여야 한다
+    (chroma 인덱스를 만드는 ingest 단계). 디스크에 확실히 남기려면 다 쓴 뒤 flush() 를 부른다.
+    """
+
+    def __init__(self, embedding_function: EmbeddingFunction, path: Optional[str] = None, capacity: int = EMBEDDING_CACHE_SIZE):
+        self.embedding_function = embedding_function
+        self.path = path
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._slots = OrderedDict()  # 텍스트 해시 -> 슬롯 번호 (오래 안 쓴 순)
+        self._free = []  # 비어 있는 슬롯 번호. 작은 번호부터 쓰도록 뒤에서 꺼낸다
+        self._vectors = None
+        self._keys = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path and os.path.exists(path + ".npy") and os.path.exists(path + ".keys.npy"):
+            vectors = np.load(path + ".npy", mmap_mode="r+")
+            keys = np.load(path + ".keys.npy", mmap_mode="r+")
+            # 용량 설정이 바뀌었으면 처음부터 다시 채운다
+            if vectors.shape[0] == capacity and keys.shape == (capacity, _KEY_BYTES):
+                self._vectors, self._keys = vectors, keys
+                used = keys.any(axis=1)
+                for slot in np.flatnonzero(used):
+                    self._slots[keys[slot].tobytes()] = int(slot)
+                # 쓰다가 죽어 키가 지워진 슬롯은 중간에 있어도 빈 슬롯으로 다시 쓴다
+                self._free = [int(slot) for slot in np.flatnonzero(~used)[::-1]]
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [hashlib.sha256(text.encode("utf-8")).digest() for text in input]
+        results = [None] * len(input)
+        missing = []
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                slot = self._slots.get(key)
+                if slot is None:
+                    missing.append(i)
+                    continue
+                self._slots.move_to_end(key)
+                results[i] = np.array(self._vectors[slot])
+            self.hits += len(input) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            computed = self.embedding_function([input[i] for i in missing])
+            with self._lock:
+                for i, vector in zip(missing, computed):
+                    vector = np.asarray(vector, dtype=np.float32)
+                    results[i] = vector
+                    self._store(keys[i], vector)
+        return results
+
+    def _allocate(self, dimension: int):
+        self._free = list(range(self.capacity - 1, -1, -1))
+        if not self.path:
+            self._vectors = np.zeros((self.capacity, dimension), dtype=np.float32)
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._vectors = np.lib.format.open_memmap(
+            self.path + ".npy", mode="w+", dtype=np.float32, shape=(self.capacity, dimension)
+        )
+        self._keys = np.lib.format.open_memmap(
+            self.path + ".keys.npy", mode="w+", dtype=np.uint8, shape=(self.capacity, _KEY_BYTES)
+        )
+
+    def _store(self, key: bytes, vector: np.ndarray):
+        if self._vectors is None:
+            self._allocate(vector.shape[0])
+
+        if key in self._slots:
+            slot = self._slots[key]
+            self._slots.move_to_end(key)
+        elif self._free:
+            slot = self._free.pop()
+            self._slots[key] = slot
+        else:
+            # 가장 오래 안 쓴 항목의 슬롯을 재사용
+            _, slot = self._slots.popitem(last=False)
+            self._slots[key] = slot
+            self.evictions += 1
+
+        if self._keys is not None:
+            # 벡터를 다 쓰기 전에 죽어도 엉뚱한 벡터를 돌려주지 않도록 키를 먼저 지우고 마지막에 쓴다
+            self._keys[slot] = 0
+            self._vectors[slot] = vector
+            self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+        else:
+            self._vectors[slot] = vector
+
+    def flush(self):
+        with self._lock:
+            if self._keys is not None:
+                self._vectors.flush()
+                self._keys.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._slots),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,75 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", os.path.join("history", "history.sqlite3"))
+# 유저별로 남겨둘 최대 메시지 수와 보관 기간(초)
+HISTORY_MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", "20"))
+HISTORY_TTL_SECONDS = int(os.environ.get("HISTORY_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+_local = threading.local()
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # sqlite3 커넥션은 스레드 간 공유가 안 되므로 스레드마다 하나씩 둔다
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_path)
+    if conn is None:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS message ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id TEXT NOT NULL,"
+            " body TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS message_user_id ON message (user_id, id)")
+        connections[db_path] = conn
+    return conn
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """카카오 유저 id 별 대화 기록. 최근 k 턴만 읽고, 오래된 메시지는 쓰기 시점에 정리한다."""
+
+    def __init__(self, user_id: str, k: int = 3, db_path: Optional[str] = None):
+        self.user_id = user_id
+        self.k = k
+        self.db_path = db_path or HISTORY_DB_PATH
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        rows = _connect(self.db_path).execute(
+            "SELECT body FROM message WHERE user_id = ? AND created_at >= ? ORDER BY id DESC LIMIT ?",
+            (self.user_id, time.time() - HISTORY_TTL_SECONDS, self.k * 2),
+        ).fetchall()
+        return messages_from_dict([json.loads(body) for body, in reversed(rows)])
+
+    def add_message(self, message: BaseMessage) -> None:
+        conn = _connect(self.db_path)
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO message (user_id, body, created_at) VALUES (?, ?, ?)",
+                (self.user_id, json.dumps(message_to_dict(message), ensure_ascii=False), now),
+            )
+            conn.execute(
+                "DELETE FROM message WHERE user_id = ? AND (created_at < ? OR id <= ("
+                " SELECT id FROM message WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?))",
+                (self.user_id, now - HISTORY_TTL_SECONDS, self.user_id, HISTORY_MAX_MESSAGES),
+            )
+
+    def clear(self) -> None:
+        _connect(self.db_path).execute("DELETE FROM message WHERE user_id = ?", (self.user_id,))
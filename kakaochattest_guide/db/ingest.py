@@ -0,0 +1,6 @@
+# 서빙 프로세스와 분리해서 chroma 인덱스를 미리 만들어 두는 오프라인 단계
+#   python -m db.ingest
+import db.db
+
+if __name__ == "__main__":
+    db.db.ingest_all()
@@ -0,0 +1,89 @@
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+
+# BM25 파라미터
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    # 한국어는 띄어쓰기/조사 때문에 단어 단위보다 글자 2-gram 이 상품명 매칭에 잘 맞는다
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = []
+    for word in re.findall(r"\w+", text):
+        if len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+class LexicalIndex:
+    """청크 단위 BM25 인덱스. 메모리에 통째로 올려두고 역색인으로 점수를 계산한다."""
+
+    def __init__(self, ids: list[str], documents: list[str], metadatas: list[dict], postings: dict, doc_lengths: list[int]):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.postings = postings  # term -> [[문서 번호, tf], ...]
+        self.doc_lengths = doc_lengths
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        self.idf = {
+            term: math.log(1 + (len(ids) - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in postings.items()
+        }
+
+    @classmethod
+    def build(cls, chunks: list[dict]) -> "LexicalIndex":
+        postings = {}
+        doc_lengths = []
+        for i, chunk in enumerate(chunks):
+            terms = Counter(tokenize(chunk["document"]))
+            doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append([i, tf])
+        return cls(
+            ids=[chunk["id"] for chunk in chunks],
+            documents=[chunk["document"] for chunk in chunks],
+            metadatas=[chunk["metadata"] for chunk in chunks],
+            postings=postings,
+            doc_lengths=doc_lengths,
+        )
+
+    def search(self, query: str, n_results: int) -> list[dict]:
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = K1 * (1 - B + B * self.doc_lengths[i] / self.avg_length)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+        return [
+            {"id": self.ids[i], "document": self.documents[i], "metadata": self.metadatas[i], "bm25": score}
+            for i, score in best
+        ]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas,
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with open(path, "r") as f:
+            return cls(**json.load(f))
@@ -0,0 +1,69 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Optional
+
+import metrics
+
+# 카카오 callbackUrl 은 발급 후 1분 동안만 유효하다. 여유를 두고 이 시간이 지나면 보내지 않는다
+CALLBACK_DEADLINE_SECONDS = float(os.environ.get("CALLBACK_DEADLINE_SECONDS", "55"))
+# 남은 시간이 이보다 적으면 LLM 을 부르지 않고 준비된 문구로 답한다
+DEADLINE_FALLBACK_SECONDS = float(os.environ.get("DEADLINE_FALLBACK_SECONDS", "8"))
+# 단계별 최대 시간. STAGE_TIMEOUTS='{"guide": 20}' 처럼 일부만 덮어쓸 수 있다
+STAGE_TIMEOUTS = {
+    "history_load": 2.0,
+    "history_write": 2.0,
+    "intent_router": 5.0,
+    "retrieval": 5.0,
+    "intent": 15.0,
+    "guide": 30.0,
+    "intent_not_found": 15.0,
+    "structured": 30.0,
+    "callback_post": 10.0,
+    **json.loads(os.environ.get("STAGE_TIMEOUTS", "{}")),
+}
+
+CALLBACK_DEADLINES = metrics.Counter(
+    "callback_deadline_total", "Callbacks cut short by their deadline (expired, timeout, fallback, history_timeout)"
+)
+
+# 현재 처리 중인 요청의 마감 시각 (time.time() 기준). 새 task / to_thread 에도 그대로 따라간다
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def new_deadline() -> float:
+    return time.time() + CALLBACK_DEADLINE_SECONDS
+
+
+@contextmanager
+def scope(deadline: Optional[float]):
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float:
+    deadline = _deadline.get()
+    return float("inf") if deadline is None else deadline - time.time()
+
+
+async def run(stage: str, awaitable: Awaitable):
+    """단계 제한 시간과 요청 마감 중 먼저 오는 쪽까지만 기다린다. 넘으면 DeadlineExceeded."""
+    left = remaining()
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, timeout=min(STAGE_TIMEOUTS.get(stage, left), left))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage) from None
@@ -3,7 +3,7 @@ from typing import Optional
 
 class User(BaseModel):
     id: str
-    properties: dict 
+    properties: dict
 
 class UserRequest(BaseModel):
     utterance: str
@@ -17,3 +17,16 @@ class ChatbotRequest(BaseModel):
     userRequest: UserRequest
     intent: Intent
     action: dict
+
+
+# /callback 처리에 실제로 쓰는 필드만 검사하는 모델. 나머지 필드(action, properties 등)는 읽지 않고 버린다
+class SkillUser(BaseModel):
+    id: str
+
+class SkillUserRequest(BaseModel):
+    utterance: str
+    callbackUrl: Optional[str] = None
+    user: SkillUser
+
+class SkillRequest(BaseModel):
+    userRequest: SkillUserRequest
@@ -0,0 +1,29 @@
+# gunicorn -c gunicorn.conf.py api:app
+#
+# 마스터가 fork 전에 `python -m db.ingest` 로 chroma 인덱스를 한 번만 만들고,
+# 워커들은 CHROMA_READ_ONLY=true 로 같은 인덱스를 읽기만 한다.
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = os.environ.get("BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(min(4, multiprocessing.cpu_count()))))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 60
+# api 모듈(fastapi 등)을 마스터에서 한 번 import 하고 fork 해서 워커들이 copy-on-write 로 나눠 쓴다.
+# chroma 클라이언트 / LLM 체인은 fork 뒤 각 워커의 lifespan 에서 만든다 (callback.warm_up)
+preload_app = True
+
+raw_env = ["INGEST_ON_STARTUP=false", "CHROMA_READ_ONLY=true"]
+# 이미지 빌드 / 배포 단계에서 `python -m db.ingest` 를 따로 돌렸다면 false 로 마스터의 업로드를 건너뛴다
+INGEST_BEFORE_FORK = os.environ.get("INGEST_BEFORE_FORK", "true").lower() == "true"
+
+
+def on_starting(server):
+    if not INGEST_BEFORE_FORK:
+        return
+    # 마스터 프로세스에 chroma 클라이언트가 남지 않도록 별도 프로세스에서 업로드한다
+    # raw_env 는 마스터 환경에도 들어가므로 업로드하는 프로세스에서는 읽기 전용을 끈다
+    env = {**os.environ, "CHROMA_READ_ONLY": "false"}
+    subprocess.run([sys.executable, "-m", "db.ingest"], check=True, env=env)
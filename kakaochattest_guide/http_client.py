@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import os
+import random
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger("HttpClient")
+
+CALLBACK_TIMEOUT_SECONDS = float(os.environ.get("CALLBACK_TIMEOUT_SECONDS", "5"))
+CALLBACK_RETRIES = int(os.environ.get("CALLBACK_RETRIES", "3"))
+CALLBACK_CONNECTION_LIMIT = int(os.environ.get("CALLBACK_CONNECTION_LIMIT", "100"))
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def start():
+    """FastAPI lifespan 에서 한 번 호출해 프로세스 전체가 커넥션 풀을 공유한다."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=CALLBACK_CONNECTION_LIMIT,
+                limit_per_host=CALLBACK_CONNECTION_LIMIT,
+                keepalive_timeout=30,
+                ttl_dns_cache=300,
+                ssl=False,
+            ),
+            timeout=aiohttp.ClientTimeout(total=CALLBACK_TIMEOUT_SECONDS),
+        )
+
+
+async def close():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def post_callback(url: str, payload: dict) -> Optional[int]:
+    """콜백 URL 로 응답을 보낸다. 5xx / 네트워크 오류는 지터를 준 백오프로 재시도한다."""
+    await start()
+    for attempt in range(1, CALLBACK_RETRIES + 1):
+        try:
+            async with _session.post(url=url, json=payload) as resp:
+                body = await resp.text()
+                if resp.status < 500:
+                    if resp.status >= 400:
+                        logger.warning(f"callback rejected status={resp.status} body={body[:200]}")
+                    return resp.status
+                logger.warning(f"callback failed status={resp.status} attempt={attempt}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"callback error {e!r} attempt={attempt}")
+
+        if attempt < CALLBACK_RETRIES:
+            await asyncio.sleep(random.uniform(0, 0.2 * 2 ** attempt))
+    return None
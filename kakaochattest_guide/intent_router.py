@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import time
+from typing import Optional
+
+import db.db
+
+# 1등과 2등 컬렉션의 거리 차이가 이보다 작거나, 1등 거리가 너무 멀면 LLM 에게 맡긴다
+INTENT_ROUTER_MARGIN = float(os.environ.get("INTENT_ROUTER_MARGIN", "0.05"))
+INTENT_ROUTER_MAX_DISTANCE = float(os.environ.get("INTENT_ROUTER_MAX_DISTANCE", "0.6"))
+
+
+def route(utterance: str, distances: Optional[dict[str, float]] = None) -> Optional[str]:
+    """Chroma 컬렉션과의 거리로 intent 를 고른다. 확신이 없으면 None."""
+    if distances is None:
+        distances = db.db.intent_distances(utterance)
+    distances = sorted(distances.items(), key=lambda item: item[1])
+    if not distances:
+        return None
+
+    intent, best = distances[0]
+    runner_up = distances[1][1] if len(distances) > 1 else float("inf")
+    if best > INTENT_ROUTER_MAX_DISTANCE or runner_up - best < INTENT_ROUTER_MARGIN:
+        return None
+    return intent
+
+
+def evaluate(samples: list[dict], classify) -> dict:
+    """classify 가 None 을 돌려주면 (확신 없음 -> LLM 에게 넘김) 정답/오답 어느 쪽에도 넣지 않고 따로 센다.
+
+    accuracy 는 전체 샘플 기준 (기권은 틀린 것으로), answered_accuracy 는 직접 고른 샘플 기준이다.
+    """
+    correct = 0
+    abstained = 0
+    latencies = []
+    for sample in samples:
+        started = time.perf_counter()
+        predicted = classify(sample["question"])
+        latencies.append(time.perf_counter() - started)
+        if predicted is None:
+            abstained += 1
+        elif predicted == sample["intent"] or (predicted not in db.db.intents() and sample["intent"] == "none"):
+            correct += 1
+
+    answered = len(samples) - abstained
+    latencies.sort()
+    return {
+        "accuracy": correct / len(samples),
+        "answered_accuracy": correct / answered if answered else 0.0,
+        "abstained": abstained,
+        "coverage": answered / len(samples),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    # 오프라인 평가: python intent_router.py [eval/questions.json] [--llm]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    with open(args[0] if args else os.path.join("eval", "questions.json"), "r") as f:
+        samples = json.load(f)
+
+    # 로컬 라우터가 기권한 질문은 실제 서비스에서 LLM 으로 넘어간다
+    print(f"local router: {evaluate(samples, route)}")
+
+    if "--llm" in sys.argv:
+        import callback
+
+        callback.warm_up()
+
+        def llm_route(question: str) -> str:
+            return callback.FIND_INTENT_CHAIN.run(intent_list=callback.INTENT_LIST, question=question, context="").strip()
+
+        print(f"llm chain: {evaluate(samples, llm_route)}")
@@ -0,0 +1,288 @@
+import abc
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+import metrics
+from dto import SkillRequest
+
+logger = logging.getLogger("JobQueue")
+
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", os.path.join("jobs", "queue.sqlite3"))
+JOB_QUEUE_MAX_DEPTH = int(os.environ.get("JOB_QUEUE_MAX_DEPTH", "200"))
+JOB_QUEUE_WORKERS = int(os.environ.get("JOB_QUEUE_WORKERS", "4"))
+# 이 시간 안에 ack 되지 않은 작업은 워커가 죽은 것으로 보고 다시 꺼내간다. 콜백 유효 시간(1분) 안에
+# 다른 프로세스가 다시 처리할 수 있도록 짧게 잡고, 처리하는 동안에는 JOB_LEASE_SECONDS / 3 마다 늘린다
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "15"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+# 처리가 끝난 작업은 중복 요청을 걸러내기 위해 이 시간 동안 남겨둔다
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", "3600"))
+
+QUEUE_DEPTH = metrics.Gauge("job_queue_depth", "Jobs waiting or running in the callback queue")
+JOBS = metrics.Counter("job_queue_jobs_total", "Callback jobs by outcome")
+
+
+def job_id(request: SkillRequest) -> str:
+    # 카카오가 같은 요청을 재전송하면 callbackUrl 이 같으므로 이를 중복 제거 키로 쓴다
+    if request.userRequest.callbackUrl:
+        return hashlib.sha256(request.userRequest.callbackUrl.encode("utf-8")).hexdigest()
+    return uuid.uuid4().hex
+
+
+class JobQueue(abc.ABC):
+    """/callback 요청을 담아두는 큐. 최소 한 번 전달(at-least-once)을 보장해야 한다."""
+
+    @abc.abstractmethod
+    def enqueue(self, job_id: str, payload: str, lease: bool = False, max_depth: Optional[int] = None) -> Optional[bool]:
+        """작업을 넣는다. 넣었으면 True, 이미 있는 id 면 False, 대기 중인 작업이 max_depth 이상이면 None.
+
+        lease=True 면 넣는 쪽이 바로 처리하는 작업으로 넣어서 claim() 에 나오지 않는다. lease 가 끝날 때까지
+        ack() / nack() 되지 않으면 다른 워커가 claim() 으로 가져간다.
+        """
+
+    @abc.abstractmethod
+    def claim(self) -> Optional[tuple[str, str]]:
+        """처리할 작업 하나를 (id, payload) 로 꺼내고 lease 를 잡는다. 꺼낼 작업이 없으면 None.
+
+        대기 중인 작업과 lease 가 끝난 작업을 오래된 순으로 꺼내고, 꺼낼 때마다 시도 횟수를 올린다.
+        시도 횟수를 다 쓴 작업은 다시 꺼내지 않는다.
+        """
+
+    @abc.abstractmethod
+    def ack(self, job_id: str):
+        """처리가 끝난 작업. 다시 꺼내지 않지만, 같은 id 가 다시 들어오면 중복으로 거를 수 있게 한동안 남겨둔다."""
+
+    @abc.abstractmethod
+    def nack(self, job_id: str):
+        """처리에 실패한 작업. 시도 횟수가 남았으면 잠시 뒤 다시 꺼낼 수 있게 돌려놓고, 다 썼으면 실패로 끝낸다."""
+
+    @abc.abstractmethod
+    def renew(self, job_id: str):
+        """처리 중인 작업의 lease 를 지금부터 JOB_LEASE_SECONDS 뒤로 늘린다. 처리 중이 아니면 아무것도 하지 않는다."""
+
+    @abc.abstractmethod
+    def depth(self) -> int:
+        """대기 중이거나 처리 중인 작업 수."""
+
+
+class SQLiteJobQueue(JobQueue):
+    def __init__(self, db_path: str = JOB_QUEUE_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job ("
+                " id TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " available_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_status ON job (status, available_at)")
+        return conn
+
+    def enqueue(self, job_id: str, payload: str, lease: bool = False, max_depth: Optional[int] = None) -> Optional[bool]:
+        # lease=True 면 넣는 쪽이 바로 처리 중인 작업으로 넣는다. lease 가 끝나기 전에 ack 되지 않으면 워커가 가져간다
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM job WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (now - JOB_RETENTION_SECONDS,),
+            )
+            # 깊이 확인과 INSERT 를 한 트랜잭션에서 해야 동시에 들어온 요청들이 한도를 넘기지 않는다
+            if max_depth is not None:
+                depth = conn.execute("SELECT COUNT(*) FROM job WHERE status IN ('pending', 'running')").fetchone()[0]
+                if depth >= max_depth:
+                    return None
+            if lease:
+                row = (job_id, payload, "running", 1, now + JOB_LEASE_SECONDS, now)
+            else:
+                row = (job_id, payload, "pending", 0, now, now)
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO job (id, payload, status, attempts, available_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                row,
+            ).rowcount
+        return inserted == 1
+
+    def claim(self) -> Optional[tuple[str, str]]:
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # lease 가 끝났는데 시도 횟수를 다 쓴 작업은 워커를 죽이는 작업일 수 있으므로 더 꺼내지 않는다
+            conn.execute(
+                "UPDATE job SET status = 'failed', updated_at = ?"
+                " WHERE status = 'running' AND available_at <= ? AND attempts >= ?",
+                (now, now, JOB_MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                "SELECT id, payload FROM job WHERE status IN ('pending', 'running') AND available_at <= ?"
+                " AND attempts < ? ORDER BY available_at LIMIT 1",
+                (now, JOB_MAX_ATTEMPTS),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE job SET status = 'running', attempts = attempts + 1, available_at = ?, updated_at = ?"
+                " WHERE id = ?",
+                (now + JOB_LEASE_SECONDS, now, row[0]),
+            )
+        return row
+
+    def ack(self, job_id: str):
+        self._connect().execute(
+            "UPDATE job SET status = 'done', updated_at = ? WHERE id = ?", (time.time(), job_id)
+        )
+
+    def nack(self, job_id: str):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE job SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+            " available_at = ? + attempts * 2, updated_at = ? WHERE id = ?",
+            (JOB_MAX_ATTEMPTS, now, now, job_id),
+        )
+
+    def renew(self, job_id: str):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE job SET available_at = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+            (now + JOB_LEASE_SECONDS, now, job_id),
+        )
+
+    def depth(self) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM job WHERE status IN ('pending', 'running')"
+        ).fetchone()[0]
+
+
+class WorkerPool:
+    """큐에서 작업을 꺼내 handler 를 실행하는 비동기 워커들."""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Optional[Callable[[SkillRequest, Optional[float]], Awaitable]],
+        workers: int = JOB_QUEUE_WORKERS,
+        poll_interval: float = 1.0,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._wakeup = None
+        self._leases = {}  # 처리 중인 작업 id -> lease 를 늘리는 task
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for id in list(self._leases):
+            self._release(id)
+
+    async def submit(
+        self, request: SkillRequest, deadline: Optional[float] = None, id: Optional[str] = None, lease: bool = False
+    ) -> Optional[bool]:
+        """큐에 넣는다. 가득 찼으면 None, 이미 받은 요청이면 False. deadline 은 handler 에 그대로 넘긴다.
+
+        lease=True 면 호출한 쪽이 직접 처리하고 끝나면 같은 id 로 ack() / nack() 을 불러야 한다.
+        그 전에 프로세스가 죽으면 lease 가 끝난 뒤 워커가 다시 처리한다.
+        """
+        id = id or job_id(request)
+        payload = json.dumps({"request": jsonable_encoder(request), "deadline": deadline}, ensure_ascii=False)
+        enqueued = await asyncio.to_thread(self.queue.enqueue, id, payload, lease, JOB_QUEUE_MAX_DEPTH)
+        if enqueued is None:
+            JOBS.inc(result="rejected")
+            return None
+        JOBS.inc(result="enqueued" if enqueued else "duplicate")
+        if enqueued:
+            QUEUE_DEPTH.inc()
+            if lease:
+                self._hold(id)
+            elif self._wakeup is not None:
+                self._wakeup.set()
+        return enqueued
+
+    async def ack(self, id: str):
+        self._release(id)
+        JOBS.inc(result="done")
+        await asyncio.to_thread(self.queue.ack, id)
+        QUEUE_DEPTH.set(await asyncio.to_thread(self.queue.depth))
+
+    async def nack(self, id: str):
+        self._release(id)
+        JOBS.inc(result="error")
+        await asyncio.to_thread(self.queue.nack, id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _hold(self, id: str):
+        # 처리하는 동안 lease 를 계속 늘려서, 살아 있는 작업을 다른 워커가 가져가지 않게 한다
+        self._leases[id] = asyncio.ensure_future(self._renew(id))
+
+    def _release(self, id: str):
+        task = self._leases.pop(id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _renew(self, id: str):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await asyncio.to_thread(self.queue.renew, id)
+            except sqlite3.Error:
+                logger.exception(f"failed to renew the lease of job {id}")
+
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            id, payload = job
+            payload = json.loads(payload)
+            if "request" not in payload:
+                # deadline 이 없던 때 쌓인 작업
+                payload = {"request": payload, "deadline": None}
+            self._hold(id)
+            try:
+                await self.handler(SkillRequest(**payload["request"]), payload["deadline"])
+            except asyncio.CancelledError:
+                # 종료 중이면 lease 를 바로 풀어서, 재시작한 프로세스가 콜백 유효 시간 안에 다시 처리하게 한다
+                await self.nack(id)
+                raise
+            except Exception:
+                logger.exception(f"job {id} failed")
+                await self.nack(id)
+            else:
+                await self.ack(id)
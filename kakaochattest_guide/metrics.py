@@ -0,0 +1,116 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# prometheus_client 없이 /metrics 에서 읽을 수 있는 text exposition 포맷만 직접 만든다
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        _registry.append(self)
+
+    def _render_values(self) -> list[str]:
+        return [f"{self.name}{_label_text(labels)} {value}" for labels, value in self._values.items()]
+
+    def render(self) -> list[str]:
+        with _lock:
+            lines = self._render_values()
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_values(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_label_text(labels + (('le', bound),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_label_text(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_label_text(labels)} {total}")
+            lines.append(f"{self.name}_count{_label_text(labels)} {count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+CALLBACK_IN_FLIGHT = Gauge("callback_in_flight", "Callbacks currently being processed")
+CALLBACK_STAGE_SECONDS = Histogram("callback_stage_seconds", "Time spent in each callback stage")
+LLM_TOKENS = Counter("llm_tokens_total", "Prompt and completion tokens per chain and model")
+GUIDE_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "guide_time_to_first_token_seconds", "Time until the first streamed guide token"
+)
+GUIDE_TOTAL_SECONDS = Histogram("guide_total_seconds", "Time until the streamed guide answer was complete")
+LLM_CALL_SECONDS = Histogram("llm_call_seconds", "LLM completion latency per chain and model")
+GUIDE_ESCALATIONS = Counter("guide_escalations_total", "Guide answers escalated to another model, by reason (prompt_tokens, low_confidence)")
+ANSWER_CACHE_REQUESTS = Counter("answer_cache_requests_total", "Answer cache lookups by result")
+
+
+@contextmanager
+def stage(name: str):
+    with CALLBACK_STAGE_SECONDS.time(stage=name):
+        yield
@@ -0,0 +1,76 @@
+#-*- coding: utf-8 -*-
+import json
+from typing import Optional
+
+from fastapi.responses import Response
+
+# 스킬 응답 포맷 : https://kakaobusiness.gitbook.io/main/tool/chatbot/skill_guide/answer_json_format
+SKILL_VERSION = "2.0"
+
+
+def simple_text(text: str) -> dict:
+    return {"simpleText": {"text": text}}
+
+
+def web_link_button(label: str, url: str) -> dict:
+    return {"label": label, "action": "webLink", "webLinkUrl": url}
+
+
+def basic_card(title: str, description: str, thumbnail_url: str, buttons: Optional[list[dict]] = None) -> dict:
+    card = {"title": title, "description": description, "thumbnail": {"imageUrl": thumbnail_url}}
+    if buttons:
+        card["buttons"] = buttons
+    return {"basicCard": card}
+
+
+def commerce_card(
+    description: str,
+    price: int,
+    thumbnail_url: str,
+    link_url: Optional[str] = None,
+    title: str = "",
+    discount_rate: Optional[int] = None,
+    discounted_price: Optional[int] = None,
+    currency: str = "won",
+    buttons: Optional[list[dict]] = None,
+) -> dict:
+    card = {"title": title, "description": description, "price": price}
+    if discount_rate is not None:
+        card["discountRate"] = discount_rate
+    if discounted_price is not None:
+        card["discountedPrice"] = discounted_price
+    card["currency"] = currency
+
+    thumbnail = {"imageUrl": thumbnail_url}
+    if link_url:
+        thumbnail["link"] = {"web": link_url}
+    card["thumbnails"] = [thumbnail]
+    if buttons:
+        card["buttons"] = buttons
+    return {"commerceCard": card}
+
+
+def quick_reply(label: str, message_text: str) -> dict:
+    return {"messageText": message_text, "action": "message", "label": label}
+
+
+def skill_response(outputs: list[dict], quick_replies: Optional[list[dict]] = None) -> dict:
+    template = {"outputs": outputs}
+    if quick_replies:
+        template["quickReplies"] = quick_replies
+    return {"version": SKILL_VERSION, "template": template}
+
+
+def use_callback(text: str) -> dict:
+    # 콜백 활성화 응답. 실제 답변은 나중에 callbackUrl 로 보낸다
+    return {"version": SKILL_VERSION, "useCallback": True, "data": {"text": text}}
+
+
+def serialize(response: dict) -> bytes:
+    """바뀌지 않는 응답은 import 할 때 한 번만 직렬화해 두고 raw() 로 그대로 내려보낸다."""
+    return json.dumps(response, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def raw(body: bytes, status_code: int = 200) -> Response:
+    # FastAPI 의 jsonable_encoder / pydantic 직렬화를 거치지 않는다
+    return Response(content=body, status_code=status_code, media_type="application/json")
@@ -0,0 +1,116 @@
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+import chromadb
+
+import context_builder
+import db.db
+import tokens
+from db.lexical import LexicalIndex
+
+
+def recall_at_k(samples: list[dict], search, k: int) -> dict:
+    """정답 섹션(sample["section"]) 의 청크가 search 결과 상위 k 개 안에 하나라도 있으면 맞힌 것으로 센다.
+
+    section 이 없는 샘플 (intent 가 none) 은 검색할 문서가 없으므로 빼고 계산한다.
+    """
+    samples = [sample for sample in samples if sample.get("section")]
+    found = 0
+    latencies = []
+    for sample in samples:
+        started = time.perf_counter()
+        hits = search(sample["intent"], sample["question"], k)[:k]
+        latencies.append(time.perf_counter() - started)
+        if any(hit["metadata"]["title"] == sample["section"] for hit in hits):
+            found += 1
+
+    latencies.sort()
+    return {
+        f"recall@{k}": found / len(samples),
+        "samples": len(samples),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+def related_doc_tokens(samples: list[dict], search, n_results: int = db.db.RETRIEVAL_RESULTS) -> dict:
+    """답변마다 GUIDE_PROMPT 의 {related_doc} 에 들어가는 토큰 수 (context_builder 예산으로 자른 뒤)."""
+    counts = sorted(
+        tokens.count_tokens(context_builder.build_related_doc(search(sample["intent"], sample["question"], n_results)))
+        for sample in samples
+        if sample.get("section")
+    )
+    return {
+        "related_doc_tokens_mean": sum(counts) / len(counts),
+        "related_doc_tokens_p50": counts[len(counts) // 2],
+        "related_doc_tokens_max": counts[-1],
+    }
+
+
+def _section_chunks(file_path: str) -> list[dict]:
+    # 청크로 나누기 전처럼 섹션 하나를 문서 하나로 저장한다
+    chunks = []
+    for i, (title, lines) in enumerate(db.db._read_sections(file_path)):
+        chunks.append({
+            "id": re.sub(r"\s+", "-", title) + f"-{i}",
+            "document": f"{title} : " + "\n".join(lines),
+            "metadata": {"title": title, "chunk": 0},
+        })
+    return chunks
+
+
+@contextmanager
+def _in_memory_index(name: str, load_chunks):
+    """data 파일로 메모리 위 chroma / BM25 인덱스를 만들고, 그동안 db.db 의 검색이 이 인덱스를 쓰게 한다."""
+    client = chromadb.EphemeralClient()
+    embedding_function = db.db.get_embedding_function()
+    collections, lexical_indexes = {}, {}
+    for config in db.db.load_registry():
+        chunks = load_chunks(config["data_file"])
+        documents = [chunk["document"] for chunk in chunks]
+        collection = client.get_or_create_collection(
+            name=f"{config['name']}-{name}", metadata={"hnsw:space": "cosine"}, embedding_function=embedding_function
+        )
+        collection.upsert(
+            ids=[chunk["id"] for chunk in chunks],
+            documents=documents,
+            metadatas=[chunk["metadata"] for chunk in chunks],
+            embeddings=embedding_function(documents),
+        )
+        collections[config["intent"]] = collection
+        lexical_indexes[config["intent"]] = LexicalIndex.build(chunks)
+
+    saved = dict(db.db._collections), dict(db.db._lexical_indexes)
+    db.db._collections.update(collections)
+    db.db._lexical_indexes.update(lexical_indexes)
+    try:
+        yield
+    finally:
+        db.db._collections.clear()
+        db.db._collections.update(saved[0])
+        db.db._lexical_indexes.clear()
+        db.db._lexical_indexes.update(saved[1])
+
+
+if __name__ == "__main__":
+    # 오프라인 평가: python retrieval_eval.py [eval/questions.json] [--k=3]
+    # data/*.txt 로 섹션 단위 / 청크 단위 인덱스를 메모리에 만들고, 설정된 임베딩 모델로
+    # 벡터 검색만 / BM25 를 합친 검색의 recall@k 와 프롬프트에 들어가는 문서 토큰 수를 비교한다
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    k = int(options.get("k", "3"))
+    with open(args[0] if args else os.path.join("eval", "questions.json"), "r") as f:
+        samples = json.load(f)
+
+    embedding = type(db.db.get_embedding_function().embedding_function).__name__
+    for granularity, load_chunks in (("section", _section_chunks), ("chunk", db.db._load_chunks)):
+        with _in_memory_index(granularity, load_chunks):
+            for hybrid in (False, True):
+                db.db.HYBRID_RETRIEVAL = hybrid
+                name = f"{granularity}, {'vector + bm25' if hybrid else 'vector only'}"
+                result = {**recall_at_k(samples, db.db.query, k), **related_doc_tokens(samples, db.db.query)}
+                print(f"{name} ({embedding}): {result}")
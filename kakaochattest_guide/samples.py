@@ -1,95 +1,51 @@
 #-*- coding: utf-8 -*-
+import responses
 
 
 # SimpleText : https://chatbot.kakao.com/docs/skill-response-format#simpletext
-simple_text_sample = {
-    "version": "2.0",
-    "template": {
-        "outputs": [
-            {
-                "simpleText": {
-                    "text": "안녕하세요! 저는 챗봇입니다."
-                }
-            },
-            {
-                "simpleText": {
-                    "text": "어떤 카드를 보여드릴까요?"
-                }
-            },
-        ],
-        "quickReplies": [
-            {
-                "messageText": "Basic Card 보여주세요",
-                "action": "message",
-                "label": "Basic"
-            },
-            {
-                "messageText": "Commerce Card 보여주세요",
-                "action": "message",
-                "label": "Commerce"
-            },
-        ]
-    }
-}
+simple_text_sample = responses.skill_response(
+    [
+        responses.simple_text("안녕하세요! 저는 챗봇입니다."),
+        responses.simple_text("어떤 카드를 보여드릴까요?"),
+    ],
+    quick_replies=[
+        responses.quick_reply("Basic", "Basic Card 보여주세요"),
+        responses.quick_reply("Commerce", "Commerce Card 보여주세요"),
+    ],
+)
 
 # BasicCard : https://chatbot.kakao.com/docs/skill-response-format#basiccard
-basic_card_sample = {
-    "version": "2.0",
-    "template": {
-        "outputs": [
-            {
-                "basicCard": {
-                    "title": "라이언",
-                    "description": "덩치는 크지만 마음은 여린 수사자",
-                    "thumbnail": {
-                        "imageUrl": "https://t1.kakaocdn.net/friends/new_store/prod/character/character_20230609082239_4d31bb9f1570488fa272c6c3f62ead6c.jpg"
-                    },
-                    "buttons": [
-                        {
-                            "label": "더 알아보기",
-                            "action": "webLink",
-                            "webLinkUrl": "https://namu.wiki/w/%EB%9D%BC%EC%9D%B4%EC%96%B8(%EC%B9%B4%EC%B9%B4%EC%98%A4%ED%94%84%EB%A0%8C%EC%A6%88)"
-                        }
-                    ]
-                }
-            },
-        ]
-    }
-}
+basic_card_sample = responses.skill_response([
+    responses.basic_card(
+        title="라이언",
+        description="덩치는 크지만 마음은 여린 수사자",
+        thumbnail_url="https://t1.kakaocdn.net/friends/new_store/prod/character/character_20230609082239_4d31bb9f1570488fa272c6c3f62ead6c.jpg",
+        buttons=[
+            responses.web_link_button(
+                "더 알아보기",
+                "https://namu.wiki/w/%EB%9D%BC%EC%9D%B4%EC%96%B8(%EC%B9%B4%EC%B9%B4%EC%98%A4%ED%94%84%EB%A0%8C%EC%A6%88)",
+            ),
+        ],
+    ),
+])
 
 # Commerce Card : https://chatbot.kakao.com/docs/skill-response-format#commercecard
-commerce_card_sample = {
-    "version": "2.0",
-    "template": {
-        "outputs": [
-            {
-                "commerceCard": {
-                    "title": "",
-                    "description": "두 뺨이 발그레😊 매일쓰는 칫솔을 깨끗하게!",
-                    "price": 25000,
-                    "discountRate": 20,
-                    "discountedPrice": 20000,
-                    "currency": "won",
-                    "thumbnails": [
-                        {
-                            "imageUrl": "https://t1.kakaocdn.net/friends/prod/product/20230620141231526_8809922502300_AW_00.jpg",
-                            "link": {
-                                "web": "https://store.kakaofriends.com/products/9959"
-                            }
-                        }
-                    ],
-                    "buttons": [
-                        {
-                            "label": "구매하기",
-                            "action": "webLink",
-                            "webLinkUrl": "https://store.kakaofriends.com/products/9959"
-                        }
-                    ]
-                }
-            },
-        ]
-    }
-}
+commerce_card_sample = responses.skill_response([
+    responses.commerce_card(
+        description="두 뺨이 발그레😊 매일쓰는 칫솔을 깨끗하게!",
+        price=25000,
+        discount_rate=20,
+        discounted_price=20000,
+        thumbnail_url="https://t1.kakaocdn.net/friends/prod/product/20230620141231526_8809922502300_AW_00.jpg",
+        link_url="https://store.kakaofriends.com/products/9959",
+        buttons=[responses.web_link_button("구매하기", "https://store.kakaofriends.com/products/9959")],
+    ),
+])
+
+# 위 응답들은 바뀌지 않으므로 미리 직렬화해 둔 bytes 를 그대로 내려보낸다
+SIMPLE_TEXT_SAMPLE_BYTES = responses.serialize(simple_text_sample)
+BASIC_CARD_SAMPLE_BYTES = responses.serialize(basic_card_sample)
+COMMERCE_CARD_SAMPLE_BYTES = responses.serialize(commerce_card_sample)
 
 
 list_card = {
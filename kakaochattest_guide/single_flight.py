@@ -0,0 +1,30 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+import metrics
+
+SINGLE_FLIGHT_CALLS = metrics.Counter(
+    "single_flight_calls_total", "Pipeline stage calls that ran (leader) or joined an in-flight call (coalesced)"
+)
+
+
+class SingleFlight:
+    """같은 키로 동시에 들어온 호출은 먼저 온 호출 하나만 실행하고 나머지는 그 결과를 같이 받는다.
+
+    끝난 결과는 남기지 않는다 (끝난 뒤에 온 호출은 새로 실행). 결과 재사용은 AnswerCache 가 맡는다.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        future = self._calls.get(key)
+        if future is None:
+            SINGLE_FLIGHT_CALLS.inc(stage=self.name, role="leader")
+            future = self._calls[key] = asyncio.ensure_future(func())
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            SINGLE_FLIGHT_CALLS.inc(stage=self.name, role="coalesced")
+        # 한 호출자가 취소돼도 같이 기다리는 다른 호출자의 계산은 계속 돌아야 한다
+        return await asyncio.shield(future)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+logger = logging.getLogger("Streaming")
+
+# 카카오 simpleText 는 1000자, 응답 하나에 output 은 최대 3개까지
+SIMPLE_TEXT_MAX_CHARS = 1000
+MAX_OUTPUTS = 3
+# 답변이 simpleText MAX_OUTPUTS 개에 더 담기지 않거나 이 길이를 넘으면 문장이 끝나는 곳에서 생성을 끊고 바로 콜백을 보낸다
+STREAM_MAX_CHARS = int(os.environ.get("STREAM_MAX_CHARS", str(SIMPLE_TEXT_MAX_CHARS * MAX_OUTPUTS)))
+
+_SENTENCE_END = re.compile(r"[.!?。\n]\s*$")
+# 문단 안에서 문장(또는 줄) 사이의 구분자. split 결과에 구분자도 남긴다
+_SENTENCE_BREAK = re.compile(r"((?<=[.!?。])\s+|\n+)")
+
+
+@dataclass
+class StreamResult:
+    text: str
+    time_to_first_token: float
+    total_time: float
+    truncated: bool
+
+
+class _TokenQueue(AsyncCallbackHandler):
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.queue.put_nowait(token)
+
+
+async def stream_chain(chain, max_chars: int = STREAM_MAX_CHARS, **inputs) -> StreamResult:
+    """chain 을 스트리밍으로 실행하고, 답변이 출력 칸에 더 담기지 않거나 max_chars 를 넘기면 남은 생성을 취소한다.
+
+    끊을 때는 출력 칸에 다 담기는 마지막 문장까지만 남긴다.
+    """
+    handler = _TokenQueue()
+    started = time.perf_counter()
+    first_token_at = None
+    truncated = False
+    text = ""
+    fitted = ""  # 문장이 끝났고 split_outputs 에 다 담기는 가장 긴 앞부분
+
+    task = asyncio.ensure_future(chain.arun(callbacks=[handler], **inputs))
+    try:
+        while True:
+            get_token = asyncio.ensure_future(handler.queue.get())
+            done, _ = await asyncio.wait({get_token, task}, return_when=asyncio.FIRST_COMPLETED)
+            if get_token not in done:
+                get_token.cancel()
+                break
+
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            text += get_token.result()
+            if not _SENTENCE_END.search(text):
+                continue
+            if len(_pack(text)) > MAX_OUTPUTS:
+                text, truncated = fitted or text, True
+                break
+            fitted = text
+            if len(text) >= max_chars:
+                truncated = True
+                break
+    finally:
+        if not task.done():
+            task.cancel()
+
+    if not truncated:
+        # 스트리밍을 지원하지 않는 LLM 이면 토큰 없이 결과만 돌아온다
+        while not handler.queue.empty():
+            text += handler.queue.get_nowait()
+        text = task.result() or text
+
+    finished = time.perf_counter()
+    result = StreamResult(
+        text=text.strip(),
+        time_to_first_token=(first_token_at or finished) - started,
+        total_time=finished - started,
+        truncated=truncated,
+    )
+    logger.info(
+        f"guide stream ttft={result.time_to_first_token:.3f}s total={result.total_time:.3f}s "
+        f"chars={len(result.text)} truncated={result.truncated}"
+    )
+    return result
+
+
+def _pack(text: str, max_chars: int = SIMPLE_TEXT_MAX_CHARS) -> list[str]:
+    # 문단 / 문장 단위로 max_chars 에 꽉 차게 채운다. 한 문장이 max_chars 보다 길 때만 글자 수로 자른다
+    outputs = []
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+        parts = _SENTENCE_BREAK.split(paragraph)
+        separator = "\n\n"
+        for i in range(0, len(parts), 2):
+            for start in range(0, len(parts[i]), max_chars):
+                unit = parts[i][start:start + max_chars]
+                if outputs and len(outputs[-1]) + len(separator) + len(unit) <= max_chars:
+                    outputs[-1] += separator + unit
+                else:
+                    outputs.append(unit)
+                separator = ""
+            separator = parts[i + 1] if i + 1 < len(parts) else ""
+    return outputs
+
+
+def split_outputs(text: str, max_outputs: int = MAX_OUTPUTS, max_chars: int = SIMPLE_TEXT_MAX_CHARS) -> list[str]:
+    """긴 답변을 문단 / 문장 경계에서 나눠 simpleText 여러 개에 담는다. 다 못 담으면 뒤쪽 문장을 버리고 남긴다."""
+    outputs = _pack(text, max_chars)
+    if len(outputs) > max_outputs:
+        dropped = sum(len(output) for output in outputs[max_outputs:])
+        logger.warning(f"answer does not fit in {max_outputs} simpleText outputs, dropped the last {dropped} chars")
+        outputs = outputs[:max_outputs]
+    return outputs or [text[:max_chars]]
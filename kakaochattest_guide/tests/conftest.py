@@ -0,0 +1,93 @@
+import asyncio
+import os
+import sys
+import time
+import types
+
+import pytest
+
+# 앱 모듈은 kakaochattest_guide 를 기준으로 import 하고 prompt/, data/ 를 상대 경로로 읽는다
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class StubChain:
+    """LLMChain 대신 쓰는 가짜 체인. delay 초 기다린 뒤 answer 를 돌려주고 호출 횟수를 센다."""
+
+    def __init__(self, answer, delay: float = 0.0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+        self.llm = types.SimpleNamespace(model_name="stub")
+        self.prompt = types.SimpleNamespace(format=lambda **inputs: str(inputs))
+
+    async def arun(self, callbacks=None, **inputs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.answer(inputs) if callable(self.answer) else self.answer
+
+
+def count(metric, **labels) -> float:
+    return metric._values.get(tuple(sorted(labels.items())), 0)
+
+
+def skill_request(utterance: str, callback_url: str, user_id: str = "user") -> dict:
+    return {"userRequest": {"utterance": utterance, "callbackUrl": callback_url, "user": {"id": user_id}}}
+
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    import db.history
+
+    path = str(tmp_path / "history.sqlite3")
+    monkeypatch.setattr(db.history, "HISTORY_DB_PATH", path)
+    return path
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    """콜백 전송을 가로챈다. 보낸 (callbackUrl, payload) 가 순서대로 쌓인다."""
+    import http_client
+
+    posted = []
+
+    async def post_callback(url, payload):
+        posted.append((url, payload))
+        return 200
+
+    monkeypatch.setattr(http_client, "post_callback", post_callback)
+    return posted
+
+
+@pytest.fixture
+def pipeline(monkeypatch, history_db, posted):
+    """LLM 과 Chroma 를 가짜로 바꾼 callback 모듈."""
+    monkeypatch.chdir(ROOT)
+    import callback
+    import db.db
+    import tokens
+    from answer_cache import AnswerCache
+
+    # tiktoken 은 처음 쓸 때 인코딩 파일을 내려받으므로 대략적인 길이로 센다
+    monkeypatch.setattr(tokens, "count_tokens", lambda text: len(text) // 2)
+
+    def query(intent, question, n_results=db.db.RETRIEVAL_RESULTS):
+        # chroma 처럼 이벤트 루프 밖(스레드)에서 불려야 하는 동기 호출
+        time.sleep(0.02)
+        return [{"intent": intent, "id": "doc#0", "document": "문서 : 안내", "metadata": {"title": "문서"}, "distance": 0.1}]
+
+    monkeypatch.setattr(db.db, "query", query)
+    monkeypatch.setattr(callback, "INTENT_ROUTER", "llm")
+    monkeypatch.setattr(callback, "RETRIEVAL_MODE", "single")
+    monkeypatch.setattr(callback, "PIPELINE_MODE", "two_call")
+    monkeypatch.setattr(callback, "GUIDE_STREAMING", False)
+    monkeypatch.setattr(callback, "INTENT_LIST", "")
+    monkeypatch.setattr(callback, "FIND_INTENT_CHAIN", StubChain("kakao_sink", delay=0.05))
+    monkeypatch.setattr(callback, "GUIDE_CHAIN", StubChain(lambda inputs: f"답변: {inputs['question']}", delay=0.2))
+    monkeypatch.setattr(callback, "GUIDE_ESCALATION_CHAIN", None)
+    monkeypatch.setattr(callback, "GUIDE_LOW_CONFIDENCE_CHAIN", None)
+    monkeypatch.setattr(callback, "INTENT_NOT_FOUND_CHAIN", StubChain("모르는 질문이에요", delay=0.05))
+    monkeypatch.setattr(callback, "ANSWER_CACHE", AnswerCache(version=lambda: "test"))
+    # 세마포어는 처음 쓰는 이벤트 루프에 묶이므로 테스트마다 새로 만든다
+    monkeypatch.setattr(callback, "_callback_semaphore", None)
+    return callback
@@ -0,0 +1,48 @@
+import glob
+import os
+
+import pytest
+
+import db.db
+import tokens
+from conftest import ROOT
+
+
+@pytest.fixture(autouse=True)
+def offline_tokens(monkeypatch):
+    # tiktoken 은 처음 쓸 때 인코딩 파일을 내려받으므로 한글 기준 대략 2글자 = 1토큰으로 센다
+    monkeypatch.setattr(tokens, "count_tokens", lambda text: len(text) // 2)
+    monkeypatch.setattr(tokens, "tail", lambda text, n: text[-2 * n:])
+
+
+def _sections():
+    for path in sorted(glob.glob(os.path.join(ROOT, "data", "*.txt"))):
+        yield from db.db._read_sections(path)
+
+
+def test_adjacent_chunks_overlap():
+    pairs = 0
+    for _, lines in _sections():
+        chunks = list(db.db._chunk_section(lines))
+        for previous, chunk in zip(chunks, chunks[1:]):
+            pairs += 1
+            # 다음 청크의 첫 줄은 앞 청크의 끝부분이다
+            assert chunk.split("\n")[0] in previous
+            assert tokens.count_tokens(chunk.split("\n")[0]) <= db.db.CHUNK_OVERLAP_TOKENS
+    assert pairs > 0
+
+
+def test_every_sentence_is_in_some_chunk():
+    for _, lines in _sections():
+        text = "\n".join(db.db._chunk_section(lines))
+        assert all(sentence in text for sentence in db.db._split_units(lines))
+
+
+def test_long_sentence_overlap_starts_at_a_word():
+    sentence = " ".join(f"단어{i}" for i in range(200)) + "."
+    chunks = list(db.db._chunk_section(["짧은 문장.", sentence, "다음 문장."]))
+
+    assert len(chunks) == 3
+    overlap = chunks[2].split("\n")[0]
+    assert sentence.endswith(overlap)
+    assert overlap.startswith("단어")
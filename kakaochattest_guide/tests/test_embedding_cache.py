@@ -0,0 +1,58 @@
+import numpy as np
+
+from db.embedding_cache import CachedEmbeddingFunction
+
+TEXTS = ["aaaa", "bbbb", "cccc", "dddd"]
+
+
+class CountingEmbedding:
+    """텍스트마다 처음 본 순서대로 [n, n, n, n] 을 돌려주고, 모델을 부른 텍스트를 남긴다."""
+
+    def __init__(self):
+        self.values = {}
+        self.calls = []
+
+    def __call__(self, input):
+        self.calls.extend(input)
+        for text in input:
+            self.values.setdefault(text, len(self.values) + 1)
+        return [np.full(4, self.values[text], dtype=np.float32) for text in input]
+
+
+def test_reload_keeps_vectors_matched_to_keys(tmp_path):
+    path = str(tmp_path / "cache")
+    model = CountingEmbedding()
+    cache = CachedEmbeddingFunction(model, path, capacity=4)
+    cache(TEXTS)
+    cache.flush()
+
+    model.calls.clear()
+    reloaded = CachedEmbeddingFunction(model, path, capacity=4)
+    assert [list(vector) for vector in reloaded(TEXTS)] == [[n] * 4 for n in (1, 2, 3, 4)]
+    assert model.calls == []
+
+
+def test_reload_after_a_cleared_slot_reuses_that_slot(tmp_path):
+    path = str(tmp_path / "cache")
+    model = CountingEmbedding()
+    cache = CachedEmbeddingFunction(model, path, capacity=4)
+    cache(TEXTS)
+    # 슬롯 1 을 다시 쓰다가 죽은 상태: 키는 지워졌고 벡터는 그대로 남아 있다
+    cache._keys[1] = 0
+    cache.flush()
+
+    reloaded = CachedEmbeddingFunction(model, path, capacity=4)
+    assert reloaded.stats()["size"] == 3
+    model.calls.clear()
+    assert list(reloaded(["eeee"])[0]) == [5] * 4
+    assert model.calls == ["eeee"]
+
+    # 새 항목은 빈 슬롯 1 에 들어가고, 나머지 항목은 자기 벡터를 그대로 돌려준다
+    model.calls.clear()
+    assert [list(vector) for vector in reloaded(["aaaa", "cccc", "dddd"])] == [[1] * 4, [3] * 4, [4] * 4]
+    assert model.calls == []
+    assert reloaded.stats()["evictions"] == 0
+
+    # 지워진 항목은 다시 계산해서 가장 오래 안 쓴 슬롯에 넣는다
+    assert list(reloaded(["bbbb"])[0]) == [2] * 4
+    assert model.calls == ["bbbb"]
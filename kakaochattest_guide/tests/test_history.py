@@ -0,0 +1,55 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import db.history
+from db.history import SQLiteChatMessageHistory
+
+USERS = 8
+TURNS = 30
+
+
+def _chat(user_id: str):
+    history = SQLiteChatMessageHistory(user_id, k=3)
+    for turn in range(TURNS):
+        history.add_user_message(f"{user_id} 질문 {turn}")
+        history.add_ai_message(f"{user_id} 답변 {turn}")
+        # 콜백 처리처럼 쓰는 사이사이 최근 대화를 읽는다
+        assert all(message.content.startswith(f"{user_id} ") for message in history.messages)
+
+
+def test_concurrent_users_keep_separate_histories(history_db):
+    with ThreadPoolExecutor(max_workers=USERS) as executor:
+        for future in [executor.submit(_chat, f"user-{i}") for i in range(USERS)]:
+            future.result()
+
+    for i in range(USERS):
+        user_id = f"user-{i}"
+        messages = SQLiteChatMessageHistory(user_id, k=3).messages
+        # 최근 k 턴만, 순서대로
+        assert [message.content for message in messages] == [
+            f"{user_id} {kind} {turn}" for turn in range(TURNS - 3, TURNS) for kind in ("질문", "답변")
+        ]
+        assert [message.type for message in messages] == ["human", "ai"] * 3
+
+
+def test_concurrent_writes_are_capped_per_user(history_db):
+    with ThreadPoolExecutor(max_workers=USERS) as executor:
+        for future in [executor.submit(_chat, f"user-{i}") for i in range(USERS)]:
+            future.result()
+
+    rows = sqlite3.connect(history_db).execute("SELECT user_id, COUNT(*) FROM message GROUP BY user_id").fetchall()
+    assert len(rows) == USERS
+    assert all(count == db.history.HISTORY_MAX_MESSAGES for _, count in rows)
+
+
+def test_same_user_from_many_threads_loses_no_message(history_db):
+    def write(turn: int):
+        SQLiteChatMessageHistory("same-user", k=3).add_user_message(f"질문 {turn}")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(write, range(db.history.HISTORY_MAX_MESSAGES)))
+
+    messages = SQLiteChatMessageHistory("same-user", k=db.history.HISTORY_MAX_MESSAGES).messages
+    assert sorted(message.content for message in messages) == sorted(
+        f"질문 {turn}" for turn in range(db.history.HISTORY_MAX_MESSAGES)
+    )
@@ -0,0 +1,69 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+import job_queue
+from conftest import skill_request
+from dto import SkillRequest
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_LEASE_SECONDS", 0.3)
+    return job_queue.SQLiteJobQueue(str(tmp_path / "queue.sqlite3"))
+
+
+def _status(queue, id: str) -> str:
+    return sqlite3.connect(queue.db_path).execute("SELECT status FROM job WHERE id = ?", (id,)).fetchone()[0]
+
+
+def test_running_job_keeps_its_lease(queue):
+    calls = []
+
+    async def handler(request, deadline):
+        calls.append(request.userRequest.utterance)
+        # lease(0.3초) 보다 오래 걸려도 다른 워커가 가져가지 않아야 한다
+        await asyncio.sleep(1.0)
+
+    async def run():
+        workers = job_queue.WorkerPool(queue, handler, workers=2, poll_interval=0.05)
+        await workers.start()
+        await workers.submit(SkillRequest(**skill_request("질문", "http://kakao/callback/1")), id="job")
+        await asyncio.sleep(0.6)
+        assert queue.claim() is None
+        await asyncio.sleep(0.8)
+        await workers.stop()
+
+    asyncio.run(run())
+    assert calls == ["질문"]
+    assert _status(queue, "job") == "done"
+
+
+def test_stopped_worker_gives_its_job_back(queue):
+    started = []
+
+    async def handler(request, deadline):
+        started.append(1)
+        await asyncio.sleep(60)
+
+    async def run():
+        workers = job_queue.WorkerPool(queue, handler, workers=1, poll_interval=0.05)
+        await workers.start()
+        await workers.submit(SkillRequest(**skill_request("질문", "http://kakao/callback/1")), id="job")
+        while not started:
+            await asyncio.sleep(0.01)
+        await workers.stop()
+
+    asyncio.run(run())
+    # lease 가 끝나길 기다리지 않고 바로 다시 꺼낼 수 있는 상태로 돌아간다
+    assert _status(queue, "job") == "pending"
+
+
+def test_leased_job_of_a_dead_process_is_picked_up_after_the_lease(queue):
+    # 직접 처리하겠다고 lease 를 잡은 프로세스가 ack / nack 없이 죽은 경우
+    assert queue.enqueue("job", "{}", lease=True) is True
+    assert queue.claim() is None
+    time.sleep(job_queue.JOB_LEASE_SECONDS + 0.05)
+    assert queue.claim() == ("job", "{}")
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import job_queue
+from conftest import skill_request
+
+CONCURRENT_CALLBACKS = 60
+# 콜백 하나가 이벤트 루프를 막으면 /skill/hello 가 LLM 호출 시간(0.05 + 0.2초) 만큼 밀린다
+MAX_HELLO_SECONDS = 0.15
+
+
+@pytest.fixture
+def app(pipeline, tmp_path, monkeypatch):
+    import api
+
+    monkeypatch.setattr(api, "pipeline", pipeline)
+    monkeypatch.setattr(api, "workers", job_queue.WorkerPool(
+        job_queue.SQLiteJobQueue(str(tmp_path / "queue.sqlite3")), handler=pipeline.callback_handler
+    ))
+    # 답변(약 0.3초) 을 기다리지 않고 바로 useCallback 으로 넘어가게 해서 ack 지연만 본다
+    monkeypatch.setattr(api, "SYNC_ANSWER_SECONDS", 0.05)
+    return api
+
+
+async def _timed(request):
+    # 실제 서버처럼 이벤트 루프 차례를 기다려 처리되도록 별도 task 로 띄운다
+    started = time.perf_counter()
+    response = await asyncio.ensure_future(request)
+    assert response.status_code == 200
+    return response, time.perf_counter() - started
+
+
+async def _load(api, posted):
+    await api.workers.start()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as client:
+            idle = [(await _timed(client.post("/skill/hello")))[1] for _ in range(5)]
+
+            callbacks = asyncio.gather(*(
+                _timed(client.post("/callback", json=skill_request(f"질문 {i}", f"http://kakao/callback/{i}", f"user-{i}")))
+                for i in range(CONCURRENT_CALLBACKS)
+            ))
+            # 콜백들이 LLM 을 기다리는 동안 고정 응답 스킬이 얼마나 밀리는지 잰다
+            busy = []
+            while not callbacks.done():
+                busy.append((await _timed(client.post("/skill/hello")))[1])
+                await asyncio.sleep(0.01)
+            acks = await callbacks
+
+            deadline = time.monotonic() + 30
+            while len(posted) < CONCURRENT_CALLBACKS and time.monotonic() < deadline:
+                busy.append((await _timed(client.post("/skill/hello")))[1])
+                await asyncio.sleep(0.01)
+    finally:
+        await api.workers.stop()
+    return idle, busy, acks
+
+
+def test_acks_stay_fast_under_concurrent_callbacks(app, pipeline, posted):
+    idle, busy, acks = asyncio.run(_load(app, posted))
+
+    # 모든 /callback 은 답변을 기다리지 않고 useCallback 으로 바로 응답했고, 답변은 콜백으로 한 번씩 나갔다
+    assert all(response.json()["useCallback"] for response, _ in acks)
+    assert max(seconds for _, seconds in acks) < app.SYNC_ANSWER_SECONDS + 1.0
+    assert sorted(url for url, _ in posted) == sorted(f"http://kakao/callback/{i}" for i in range(CONCURRENT_CALLBACKS))
+    assert {payload["template"]["outputs"][0]["simpleText"]["text"] for _, payload in posted} == {
+        f"답변: 질문 {i}" for i in range(CONCURRENT_CALLBACKS)
+    }
+
+    # LLM 호출과 chroma / sqlite 호출이 이벤트 루프를 막지 않으므로 다른 라우트의 지연이 그대로다
+    assert len(busy) >= 10
+    assert max(busy) < max(idle) + MAX_HELLO_SECONDS
+    assert pipeline.GUIDE_CHAIN.calls == CONCURRENT_CALLBACKS
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from answer_cache import AnswerCache
+from conftest import count, skill_request
+from dto import SkillRequest
+from single_flight import SINGLE_FLIGHT_CALLS, SingleFlight
+
+CONCURRENT_REQUESTS = 30
+
+
+def test_concurrent_calls_share_one_run():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do("key", compute) for _ in range(CONCURRENT_REQUESTS)))
+        # 끝난 결과는 남기지 않으므로 다음 호출은 다시 실행된다
+        results.append(await flight.do("key", compute))
+        return results
+
+    assert asyncio.run(run()) == ["result"] * (CONCURRENT_REQUESTS + 1)
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        flight = SingleFlight("test")
+        first = asyncio.ensure_future(flight.do("key", compute))
+        second = asyncio.ensure_future(flight.do("key", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "result"
+
+
+@pytest.fixture
+def uncached_pipeline(pipeline, monkeypatch):
+    # 캐시가 아니라 single-flight 로 합쳐지는지 보려고 캐시와 동시 처리 제한을 끈다
+    monkeypatch.setattr(pipeline, "ANSWER_CACHE", AnswerCache(max_size=0, version=lambda: "test"))
+    monkeypatch.setattr(pipeline, "CALLBACK_CONCURRENCY", CONCURRENT_REQUESTS)
+    return pipeline
+
+
+def test_identical_questions_run_the_llm_once(uncached_pipeline, posted):
+    # 띄어쓰기 / 문장부호만 다른 같은 질문이 여러 사용자에게서 동시에 들어온다
+    utterances = ["카카오싱크 가입 방법?", " 카카오싱크  가입 방법 ", "카카오싱크 가입 방법!!"]
+    requests = [
+        SkillRequest(**skill_request(utterances[i % 3], f"http://kakao/callback/{i}", f"user-{i}"))
+        for i in range(CONCURRENT_REQUESTS)
+    ]
+    coalesced = count(SINGLE_FLIGHT_CALLS, stage="generate", role="coalesced")
+
+    async def run():
+        await asyncio.gather(*(uncached_pipeline.callback_handler(request) for request in requests))
+
+    asyncio.run(run())
+
+    assert uncached_pipeline.FIND_INTENT_CHAIN.calls == 1
+    assert uncached_pipeline.GUIDE_CHAIN.calls == 1
+    assert count(SINGLE_FLIGHT_CALLS, stage="generate", role="coalesced") - coalesced == CONCURRENT_REQUESTS - 1
+    # 결과는 각자의 callbackUrl 로 한 번씩 나간다
+    assert sorted(url for url, _ in posted) == sorted(f"http://kakao/callback/{i}" for i in range(CONCURRENT_REQUESTS))
+    assert len({payload["template"]["outputs"][0]["simpleText"]["text"] for _, payload in posted}) == 1
+
+
+def test_different_conversations_are_not_coalesced(uncached_pipeline, posted):
+    import db.history
+
+    # 앞선 대화가 있는 사용자는 같은 질문이라도 답이 달라질 수 있으므로 따로 계산한다
+    history = db.history.SQLiteChatMessageHistory("returning-user", k=3)
+    history.add_user_message("카카오톡 채널은 뭐야?")
+    history.add_ai_message("카카오톡 채널은 ...")
+    requests = [
+        SkillRequest(**skill_request("그럼 가입은 어떻게 해?", "http://kakao/callback/new", "new-user")),
+        SkillRequest(**skill_request("그럼 가입은 어떻게 해?", "http://kakao/callback/returning", "returning-user")),
+    ]
+
+    async def run():
+        await asyncio.gather(*(uncached_pipeline.callback_handler(request) for request in requests))
+
+    asyncio.run(run())
+
+    assert uncached_pipeline.GUIDE_CHAIN.calls == 2
+    assert sorted(url for url, _ in posted) == ["http://kakao/callback/new", "http://kakao/callback/returning"]
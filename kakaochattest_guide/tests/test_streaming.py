@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+import streaming
+from streaming import MAX_OUTPUTS, SIMPLE_TEXT_MAX_CHARS, split_outputs
+
+
+def _paragraph(chars: int, sentence: str = "카카오싱크로 간편하게 가입할 수 있어요.") -> str:
+    sentences = []
+    while len(" ".join(sentences + [sentence])) <= chars:
+        sentences.append(sentence)
+    return " ".join(sentences)
+
+
+def test_paragraphs_are_packed_across_sentence_boundaries():
+    # 900자 문단 세 개는 문단 단위로는 3칸에 안 맞지만 (900 + 900 > 1000) 문장 단위로 채우면 다 들어간다
+    text = "\n\n".join(_paragraph(900) for _ in range(3))
+    outputs = split_outputs(text)
+
+    assert len(outputs) <= MAX_OUTPUTS
+    assert all(len(output) <= SIMPLE_TEXT_MAX_CHARS for output in outputs)
+    assert "".join(outputs).replace(" ", "").replace("\n", "") == text.replace(" ", "").replace("\n", "")
+
+
+def test_overflow_keeps_whole_sentences_and_logs(caplog):
+    text = "\n\n".join(_paragraph(900) for _ in range(5))
+    with caplog.at_level(logging.WARNING, logger="Streaming"):
+        outputs = split_outputs(text)
+
+    assert len(outputs) == MAX_OUTPUTS
+    assert all(len(output) <= SIMPLE_TEXT_MAX_CHARS for output in outputs)
+    # 칸을 거의 다 채우고, 문장 중간에서 자르지 않는다
+    assert sum(len(output) for output in outputs) > MAX_OUTPUTS * SIMPLE_TEXT_MAX_CHARS * 0.9
+    assert all(output.endswith(".") for output in outputs)
+    assert "dropped" in caplog.text
+
+
+def test_line_breaks_inside_a_paragraph_are_kept():
+    text = "설정 방법\n- 앱 등록\n- 동의항목 설정\n\n자세한 내용은 문서를 참고하세요."
+    assert split_outputs(text) == [text]
+
+
+def test_a_sentence_longer_than_an_output_is_cut_by_length():
+    assert [len(output) for output in split_outputs("가" * 2500)] == [1000, 1000, 500]
+
+
+class _StreamingChain:
+    """문장 단위 토큰을 callbacks 로 흘려보내는 가짜 체인."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.sent = 0
+
+    async def arun(self, callbacks, **inputs):
+        for token in self.tokens:
+            self.sent += 1
+            for callback in callbacks:
+                await callback.on_llm_new_token(token)
+            await asyncio.sleep(0)
+        return "".join(self.tokens)
+
+
+def test_stream_stops_at_output_capacity():
+    sentence = _paragraph(280) + " "
+    chain = _StreamingChain([sentence] * 40)
+
+    result = asyncio.run(streaming.stream_chain(chain, max_chars=10 ** 6))
+
+    assert result.truncated
+    assert chain.sent < 40
+    # 끊은 답변은 버리는 문장 없이 출력 칸에 그대로 담긴다
+    assert len(streaming._pack(result.text)) <= MAX_OUTPUTS
+    assert len(result.text) > MAX_OUTPUTS * SIMPLE_TEXT_MAX_CHARS * 0.8
@@ -0,0 +1,20 @@
+import functools
+
+import tiktoken
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode(text))
+
+
+def tail(text: str, n: int) -> str:
+    """text 의 마지막 n 토큰에 해당하는 뒷부분. 토큰 경계에서 잘린 글자는 뺀다."""
+    encoded = _encoding().encode(text)
+    if len(encoded) <= n:
+        return text
+    return _encoding().decode_bytes(encoded[-n:]).decode("utf-8", errors="ignore")
@@ -1,19 +1,29 @@
 import json
 import os
+import sys
 import tkinter as tk
 from tkinter import scrolledtext
 
 import chromadb
 import openai
 import pandas as pd
+from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
 
+# 임베딩 캐시는 kakaochattest_guide 의 모듈을 같이 쓴다
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kakaochattest_guide"))
+from db.embedding_cache import CachedEmbeddingFunction  # noqa: E402
+
 load_dotenv()
 openai.api_key = os.environ.get('API_KEY')
 
 collection = chromadb.PersistentClient().get_or_create_collection(
     name="kakao-services",
-    metadata={"hnsw:space": "cosine"}
+    metadata={"hnsw:space": "cosine"},
+    # 실행할 때마다 같은 csv 를 다시 add 하므로 임베딩은 캐시에서 꺼내 쓴다
+    embedding_function=CachedEmbeddingFunction(
+        embedding_functions.DefaultEmbeddingFunction(), os.path.join("chroma", "embedding-cache")
+    ),
 )
 
 